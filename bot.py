@@ -1,20 +1,46 @@
+from __future__ import annotations
+
 import asyncio
 import random
 import time
 import os
 import logging
+import re
 import json
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.types import BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from contextlib import asynccontextmanager
+from functools import lru_cache, partial
+from types import MappingProxyType
+from aiogram import BaseMiddleware, Bot, Dispatcher, types, F
+from aiogram.types import BufferedInputFile, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from sqlalchemy import text, select
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from typing import Optional
 
+# orjson сериализует JSON быстрее стандартного json; без него используется json
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+    # Для хранилища FSM: Redis принимает bytes, декодировать строку не нужно
+    fsm_json_dumps = orjson.dumps
+except ImportError:
+    json_dumps = json.dumps
+    json_loads = json.loads
+    # Компактный JSON без \uXXXX: русские подписи в match_state занимают в 3 раза меньше места
+    fsm_json_dumps = partial(json.dumps, ensure_ascii=False, separators=(',', ':'))
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -34,11 +60,16 @@ load_dotenv()
 
 TOKEN = os.getenv("TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Хранилище FSM в Redis (если задано): состояние матчей переживает перезапуск бота
+REDIS_URL = os.getenv("REDIS_URL")
+FSM_TTL = timedelta(hours=24)
+# Длительность пауз между игровыми моментами (0 - быстрый режим без пауз)
+ANIM_DELAY = float(os.getenv("MATCH_ANIM_DELAY", "2"))
 
 # --- SQLAlchemy и PostgreSQL ---
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import Column, BigInteger, String, Integer, Boolean, select, update, delete
+from sqlalchemy import Column, BigInteger, String, Integer, Boolean, case, func, select, update, delete
 
 # Строка подключения к PostgreSQL
 engine = create_async_engine(DATABASE_URL, echo=False)
@@ -49,6 +80,7 @@ Base = declarative_base()
 
 class Player(Base):
     __tablename__ = "players"
+    # Первичный ключ: PostgreSQL строит по нему уникальный индекс, которым пользуются все запросы по user_id
     user_id = Column(BigInteger, primary_key=True)
     name = Column(String)
     position = Column(String)
@@ -68,16 +100,54 @@ class Player(Base):
     admin_selected_player_id = Column(BigInteger, nullable=True)  # ID выбранного игрока для админ-панели
 
 # --- Асинхронные функции работы с БД ---
-async def get_player(user_id):
+@asynccontextmanager
+async def _use_session(session=None):
+    """Отдает переданную сессию (коммит остается за ее владельцем) или открывает свою и коммитит ее по выходу"""
+    if session is not None:
+        yield session
+        return
+    async with async_session() as own_session:
+        yield own_session
+        await own_session.commit()
+
+async def get_player(user_id, session=None):
     try:
+        if session is not None:
+            return await session.get(Player, user_id)
         async with async_session() as session:
-            result = await session.execute(select(Player).where(Player.user_id == user_id))
-            player = result.scalar_one_or_none()
-            return player
+            return await session.get(Player, user_id)
     except Exception as e:
         logger.error(f"Ошибка при получении игрока {user_id}: {e}")
         return None
 
+# Кэш игроков для частых чтений (меню, статистика, календарь, старт матча): user_id -> (время чтения, игрок).
+# Запись живет _PLAYER_CACHE_TTL секунд и сбрасывается до и после любой записи игрока через функции этого модуля.
+# Там, где из прочитанных значений вычисляются новые (finish_match, сброс, удаление), игрок читается из базы
+_PLAYER_CACHE_TTL = 30
+_PLAYER_CACHE_MAX = 1024
+_player_cache: OrderedDict[int, tuple[float, Player]] = OrderedDict()
+
+async def get_player_cached(user_id, session=None):
+    """Возвращает игрока из кэша, перечитывая его из базы по истечении TTL"""
+    now = time.monotonic()
+    cached = _player_cache.get(user_id)
+    if cached is not None and now - cached[0] < _PLAYER_CACHE_TTL:
+        _player_cache.move_to_end(user_id)
+        return cached[1]
+    player = await get_player(user_id, session)
+    if player is None:
+        _player_cache.pop(user_id, None)
+        return None
+    _player_cache[user_id] = (now, player)
+    _player_cache.move_to_end(user_id)
+    if len(_player_cache) > _PLAYER_CACHE_MAX:
+        _player_cache.popitem(last=False)
+    return player
+
+def _forget_player(user_id):
+    """Сбрасывает закэшированного игрока после изменения его строки в базе"""
+    _player_cache.pop(user_id, None)
+
 async def create_player(user_id, name, position, club, start_date):
     try:
         player_data = {
@@ -119,45 +189,65 @@ async def create_player(user_id, name, position, club, start_date):
         logger.error(f"Критическая ошибка при создании игрока {name}: {e}")
         raise
 
-async def update_player_stats(user_id, **kwargs):
+async def update_player_stats(user_id, session=None, **kwargs):
+    """Записывает переданные поля игрока одним UPDATE; False, если игрок не найден или при ошибке.
+    С переданной сессией ошибка пробрасывается вызывающему"""
+    _forget_player(user_id)
     try:
-        async with async_session() as session:
-            result = await session.execute(select(Player).where(Player.user_id == user_id))
-            player = result.scalar_one_or_none()
-            
-            if not player:
-                logger.warning(f"Попытка обновить несуществующего игрока {user_id}")
-                return False
-            
-            current_stats = {
-                "goals": player.goals or 0,
-                "assists": player.assists or 0,
-                "saves": player.saves or 0,
-                "tackles": player.tackles or 0
-            }
-            
-            update_data = {}
-            for key, value in kwargs.items():
-                if key in ['goals', 'assists', 'saves', 'tackles']:
-                    if value > current_stats.get(key, 0):
-                        update_data[key] = current_stats.get(key, 0) + value
-                    else:
-                        update_data[key] = value
-                else:
-                    update_data[key] = value
-            
-            await session.execute(
-                update(Player).where(Player.user_id == user_id).values(**update_data)
+        async with _use_session(session) as db:
+            result = await db.execute(
+                update(Player).where(Player.user_id == user_id).values(**kwargs)
             )
-            await session.commit()
-            return True
+        # Чтение, успевшее закэшировать игрока во время записи, не должно пережить ее
+        _forget_player(user_id)
+        if result.rowcount == 0:
+            logger.warning(f"Попытка обновить несуществующего игрока {user_id}")
+            return False
+        return True
     except Exception as e:
         logger.error(f"Ошибка при обновлении статистики игрока {user_id}: {e}")
+        # Транзакция чужой сессии уже сломана - владелец должен узнать настоящую ошибку и откатить ее
+        if session is not None:
+            raise
         return False
 
+async def bump_stat(user_id, column, delta, session=None):
+    """Атомарно изменяет показатель игрока на delta (не ниже 0) и возвращает новое значение; None, если игрок не найден"""
+    _forget_player(user_id)
+    field = getattr(Player, column)
+    async with _use_session(session) as db:
+        result = await db.execute(
+            update(Player)
+            .where(Player.user_id == user_id)
+            .values({column: func.greatest(0, field + delta)})
+            .returning(field)
+        )
+    _forget_player(user_id)
+    return result.scalar_one_or_none()
+
+async def shift_last_match_date(user_id, days, session=None):
+    """Сдвигает виртуальную дату игрока на days дней одним UPDATE ... RETURNING; None, если игрок не найден"""
+    _forget_player(user_id)
+    stored = Player.last_match_date
+    # Дата хранится строкой DD.MM.YYYY, в старых записях встречается YYYY-MM-DD
+    parsed = case(
+        (stored.contains("-"), func.to_date(stored, "YYYY-MM-DD")),
+        else_=func.to_date(stored, "DD.MM.YYYY")
+    )
+    async with _use_session(session) as db:
+        result = await db.execute(
+            update(Player)
+            .where(Player.user_id == user_id)
+            .values(last_match_date=func.to_char(parsed + days, "DD.MM.YYYY"))
+            .returning(stored)
+        )
+    _forget_player(user_id)
+    return result.scalar_one_or_none()
+
 async def update_player_club(user_id, club):
     try:
         await update_player_stats(user_id, club=club)
+        _forget_calendar(user_id)
         logger.info(f"Игрок {user_id} перешел в клуб {club}")
     except Exception as e:
         logger.error(f"Ошибка при обновлении клуба игрока {user_id}: {e}")
@@ -196,6 +286,9 @@ async def init_db():
 # Замените на свой токен бота
 CHANNEL_ID = "@football_simulator"
 
+# Telegram ID администраторов бота
+ADMINS = frozenset({5259325234})
+
 class GameStates(StatesGroup):
     waiting_name = State()
     waiting_position = State()
@@ -224,6 +317,25 @@ FNL_SILVER_CLUBS = {
     "Муром": {"position": 10, "strength": 35}
 }
 
+# Клубы Серебра и, для каждого клуба, все остальные клубы лиги
+_SILVER_CLUB_NAMES = tuple(FNL_SILVER_CLUBS)
+_CLUBS_BY_CLUB = {
+    club: tuple(other for other in _SILVER_CLUB_NAMES if other != club)
+    for club in _SILVER_CLUB_NAMES
+}
+
+def _difficulty_stars(strength):
+    """Звезды сложности соперника по его силе"""
+    if strength >= 70:
+        return "⭐⭐⭐"  # Сильный соперник
+    if strength >= 50:
+        return "⭐⭐"  # Средний соперник
+    return "⭐"  # Слабый соперник
+
+# Сложность каждого клуба для календаря; неизвестный клуб считается средним (сила 50)
+_CLUB_DIFFICULTY = {club: _difficulty_stars(info["strength"]) for club, info in FNL_SILVER_CLUBS.items()}
+_DEFAULT_DIFFICULTY = _difficulty_stars(50)
+
 # 1. Добавляем список клубов ФНЛ Золото
 FNL_GOLD_CLUBS = {
     "Спартак Кс": {"position": 1, "strength": 90},
@@ -246,9 +358,55 @@ WINTER_BREAK_END = 3    # Март (конец февраля - возобнов
 DAYS_BETWEEN_MATCHES = 7  # Количество дней между матчами
 SEASON_START_DATE = "01.09.2025"  # Начало сезона в формате DD.MM.YYYY
 
+# Границы в формате (месяц, день) для сравнения дат кортежами
+_WINTER_BREAK_ENTRY = (WINTER_BREAK_START, 1)  # Начало зимнего перерыва
+_SEASON_END_CUTOFF = (SEASON_END_MONTH, 25)   # Окончание сезона
+
+# Ключи статистики игрока за матч
+_DEFAULT_STATS_KEYS = ("goals", "assists", "saves", "tackles", "fouls", "passes", "interceptions", "clearances", "throws")
+
+# Неизменяемый шаблон статистики; в матч попадает его копия
+_DEFAULT_STATS = MappingProxyType(dict.fromkeys(_DEFAULT_STATS_KEYS, 0))
+
+def _ensure_stats(match_state):
+    """Создает статистику матча, если ее еще нет, и возвращает ее"""
+    stats = match_state.get('stats')
+    if stats is None:
+        stats = match_state['stats'] = dict(_DEFAULT_STATS)
+    return stats
+
+# Функция выбора хранилища FSM: Redis при заданном REDIS_URL, иначе память процесса
+def create_fsm_storage():
+    if REDIS_URL:
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+            return RedisStorage.from_url(
+                REDIS_URL,
+                key_builder=DefaultKeyBuilder(prefix="football_game"),
+                state_ttl=FSM_TTL,
+                data_ttl=FSM_TTL,
+                json_dumps=fsm_json_dumps,
+                json_loads=json_loads
+            )
+        except ImportError:
+            logger.warning("Пакет redis не установлен, состояние FSM хранится в памяти")
+    return MemoryStorage()
+
+# Функция проверки Redis при запуске: если он недоступен, переключаемся на хранение в памяти
+async def ensure_fsm_storage():
+    storage = dp.fsm.storage
+    if isinstance(storage, MemoryStorage):
+        return
+    try:
+        await storage.redis.ping()
+    except Exception as e:
+        logger.warning(f"Redis недоступен ({e}), состояние FSM хранится в памяти")
+        await storage.close()
+        dp.fsm.storage = MemoryStorage()
+
 # Инициализация бота и диспетчера
 bot = Bot(token=TOKEN)
-dp = Dispatcher()
+dp = Dispatcher(storage=create_fsm_storage())
 
 # Функция для получения случайных предложений от клубов
 def get_random_club_offers():
@@ -265,43 +423,63 @@ def get_club_offers_keyboard(offers):
         )])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+# Статичные клавиатуры создаются один раз при загрузке модуля
+_POSITION_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🥅 Вратарь", callback_data="position_gk")],
+    [InlineKeyboardButton(text="🛡️ Защитник", callback_data="position_def")],
+    [InlineKeyboardButton(text="⚽ Нападающий", callback_data="position_fw")]
+])
+
+_MAIN_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🎮 Играть матч", callback_data="play_match")],
+    [InlineKeyboardButton(text="📊 Статистика", callback_data="show_stats")],
+    [InlineKeyboardButton(text="📅 Календарь", callback_data="show_calendar")]
+])
+
+_MAIN_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🏠 Вернуться в меню", callback_data="return_to_menu")]
+])
+
 # Создаем клавиатуру для выбора позиции
 def get_position_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🥅 Вратарь", callback_data="position_gk")],
-        [InlineKeyboardButton(text="🛡️ Защитник", callback_data="position_def")],
-        [InlineKeyboardButton(text="⚽ Нападающий", callback_data="position_fw")]
-    ])
+    return _POSITION_KB
 
 # Создаем клавиатуру для главного меню
 def get_main_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🎮 Играть матч", callback_data="play_match")],
-        [InlineKeyboardButton(text="📊 Статистика", callback_data="show_stats")],
-        [InlineKeyboardButton(text="📅 Календарь", callback_data="show_calendar")]
-    ])
+    return _MAIN_KB
 
 # Функция для создания клавиатуры для возврата в главное меню
 def get_main_menu_keyboard():
     """Возвращает клавиатуру для возврата в главное меню"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🏠 Вернуться в меню", callback_data="return_to_menu")]
-    ])
+    return _MAIN_MENU_KB
+
+# Особенности позиций в матче: защитная позиция (матч начинается с атаки соперника) и строка стартового сообщения
+POSITION_PROFILE = {
+    "Вратарь": {'defensive': True, 'kickoff_text': "⚠️ {opponent} начинает атаку!"},
+    "Защитник": {'defensive': True, 'kickoff_text': "⚠️ {opponent} начинает атаку!"},
+    "Нападающий": {'defensive': False, 'kickoff_text': "⚽ {team} владеет мячом."},
+}
+_DEFAULT_POSITION_PROFILE = POSITION_PROFILE["Нападающий"]
+
+def get_position_profile(position):
+    """Возвращает профиль позиции; неизвестные позиции играют как нападающий"""
+    return POSITION_PROFILE.get(position, _DEFAULT_POSITION_PROFILE)
 
 # Клавиатура для выбора действий во время матча
+# Зависит только от позиции и фазы, поэтому кэшируется (aiogram не изменяет разметку)
+@lru_cache(maxsize=16)
 def get_match_actions_keyboard(position, is_second_phase=False):
-    message_id = int(time.time())  # Используем для идентификации актуального сообщения
     if position == "Вратарь":
         if not is_second_phase:
             return InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🏃 Выйти на игрока", callback_data=f"action_rush_{message_id}")],
-                [InlineKeyboardButton(text="↙️ Прыгнуть влево", callback_data=f"action_left_{message_id}")],
-                [InlineKeyboardButton(text="↘️ Прыгнуть вправо", callback_data=f"action_right_{message_id}")]
+                [InlineKeyboardButton(text="🏃 Выйти на игрока", callback_data="action_rush")],
+                [InlineKeyboardButton(text="↙️ Прыгнуть влево", callback_data="action_left")],
+                [InlineKeyboardButton(text="↘️ Прыгнуть вправо", callback_data="action_right")]
             ])
         else:
             return InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="⚽ Выбить мяч", callback_data=f"action_kick_{message_id}")],
-                [InlineKeyboardButton(text="🎯 Выбросить мяч", callback_data=f"action_throw_{message_id}")]
+                [InlineKeyboardButton(text="⚽ Выбить мяч", callback_data="action_kick")],
+                [InlineKeyboardButton(text="🎯 Выбросить мяч", callback_data="action_throw")]
             ])
     elif position == "Защитник":
         if not is_second_phase:
@@ -310,9 +488,9 @@ def get_match_actions_keyboard(position, is_second_phase=False):
             return get_defender_after_defense_keyboard()
     else:
         return InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="⚽ Удар по воротам", callback_data=f"action_shot_{message_id}")],
-            [InlineKeyboardButton(text="🎯 Отдать пас", callback_data=f"action_pass_{message_id}")],
-            [InlineKeyboardButton(text="🏃 Дриблинг", callback_data=f"action_dribble_{message_id}")]
+            [InlineKeyboardButton(text="⚽ Удар по воротам", callback_data="action_shot")],
+            [InlineKeyboardButton(text="🎯 Отдать пас", callback_data="action_pass")],
+            [InlineKeyboardButton(text="🏃 Дриблинг", callback_data="action_dribble")]
         ])
 
 def get_continue_keyboard():
@@ -331,32 +509,117 @@ async def check_subscription(user_id: int) -> bool:
         print(f"Ошибка при проверке подписки: {e}")
         return False
 
+_SUBSCRIPTION_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Подписаться на канал", url=f"https://t.me/{CHANNEL_ID[1:]}")],
+    [InlineKeyboardButton(text="Проверить подписку", callback_data="check_subscription")]
+])
+
 # Функция создания клавиатуры с кнопкой подписки
 def get_subscription_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Подписаться на канал", url=f"https://t.me/{CHANNEL_ID[1:]}")],
-        [InlineKeyboardButton(text="Проверить подписку", callback_data="check_subscription")]
-    ])
+    return _SUBSCRIPTION_KB
+
+# file_id уже загруженных в Telegram изображений по ключу (папка, имя файла)
+_TG_FILE_ID_CACHE: dict[tuple[str, str], str] = {}
 
 # Функция для отправки фото с описанием
-async def send_photo_with_text(message, folder, filename, text):
-    """Отправляет фото с описанием с обработкой возможных ошибок"""
+async def send_photo_with_text(message, folder, filename, text, reply_markup=None):
+    """Отправляет фото с описанием (и клавиатурой) и возвращает отправленное сообщение"""
     try:
+        key = (folder, filename)
+        file_id = _TG_FILE_ID_CACHE.get(key)
+        if file_id:
+            # Изображение уже есть на серверах Telegram - отправляем по file_id без загрузки
+            return await message.answer_photo(file_id, caption=text, parse_mode="HTML", reply_markup=reply_markup)
         photo_path = os.path.join(BASE_DIR, 'images', folder, filename)
         if os.path.exists(photo_path):
-            with open(photo_path, 'rb') as file:
-                photo = BufferedInputFile(file.read(), filename=filename)
-                await message.answer_photo(photo, caption=text, parse_mode="HTML")
-        else:
-            logger.warning(f"Файл изображения не найден: {photo_path}")
-            await message.answer(text, parse_mode="HTML")
+            sent = await message.answer_photo(
+                FSInputFile(photo_path), caption=text, parse_mode="HTML", reply_markup=reply_markup
+            )
+            _TG_FILE_ID_CACHE[key] = sent.photo[-1].file_id
+            return sent
+        logger.warning(f"Файл изображения не найден: {photo_path}")
+        return await message.answer(text, parse_mode="HTML", reply_markup=reply_markup)
     except Exception as e:
         logger.error(f"Ошибка при отправке фото {folder}/{filename}: {e}")
         # Если не удалось отправить фото, пробуем хотя бы текст
         try:
-            await message.answer(f"{text}\n(Изображение недоступно)", parse_mode="HTML")
+            return await message.answer(
+                f"{text}\n(Изображение недоступно)", parse_mode="HTML", reply_markup=reply_markup
+            )
         except Exception as inner_e:
             logger.error(f"Дополнительная ошибка при отправке текста: {inner_e}")
+            return None
+
+# Отправка фото с паузой перед следующим моментом
+async def paced_send(message, folder, filename, text, pace):
+    """Отправляет фото и ждет только остаток паузы, не покрытый временем отправки"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await send_photo_with_text(message, folder, filename, text)
+    remaining = pace - (loop.time() - started)
+    if remaining > 0:
+        await asyncio.sleep(remaining)
+
+# Приветственное фото читается с диска один раз; после первой отправки используется file_id
+try:
+    with open("mbappe.png", "rb") as _mbappe_file:
+        _MBAPPE_BYTES = _mbappe_file.read()
+except OSError as e:
+    logger.error(f"Не удалось загрузить mbappe.png: {e}")
+    _MBAPPE_BYTES = None
+_mbappe_file_id: Optional[str] = None
+
+async def send_welcome_photo(message, caption, reply_markup):
+    """Отправляет приветственное фото с подписью и клавиатурой"""
+    global _mbappe_file_id
+    if _mbappe_file_id:
+        return await message.answer_photo(_mbappe_file_id, caption=caption, reply_markup=reply_markup)
+    if _MBAPPE_BYTES is None:
+        raise FileNotFoundError("mbappe.png")
+    sent = await message.answer_photo(
+        BufferedInputFile(_MBAPPE_BYTES, filename="mbappe.png"),
+        caption=caption,
+        reply_markup=reply_markup
+    )
+    _mbappe_file_id = sent.photo[-1].file_id
+    return sent
+
+# Отправка нескольких фото одним альбомом
+async def send_photo_group(message, items):
+    """Отправляет фото (папка, файл, подпись) одним альбомом; при проблемах - по одному"""
+    if len(items) == 1:
+        await send_photo_with_text(message, *items[0])
+        return
+    media = []
+    for folder, filename, caption in items:
+        file_id = _TG_FILE_ID_CACHE.get((folder, filename))
+        if file_id is None:
+            photo_path = os.path.join(BASE_DIR, 'images', folder, filename)
+            if not os.path.exists(photo_path):
+                # Без одного из фото альбом не собрать - отправляем как обычно
+                break
+            file_id = FSInputFile(photo_path)
+        media.append(InputMediaPhoto(media=file_id, caption=caption, parse_mode="HTML"))
+    else:
+        try:
+            sent = await message.answer_media_group(media)
+            for (folder, filename, _), sent_message in zip(items, sent):
+                _TG_FILE_ID_CACHE[(folder, filename)] = sent_message.photo[-1].file_id
+            return
+        except Exception as e:
+            logger.error(f"Ошибка при отправке альбома: {e}")
+    for item in items:
+        await send_photo_with_text(message, *item)
+
+# Отправка альбома с паузой перед следующим моментом
+async def paced_send_group(message, items, pace):
+    """Отправляет альбом и ждет только остаток паузы, не покрытый временем отправки"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await send_photo_group(message, items)
+    remaining = pace - (loop.time() - started)
+    if remaining > 0:
+        await asyncio.sleep(remaining)
 
 # Улучшенная функция ожидания с защитой от ошибок
 async def safe_sleep(seconds):
@@ -371,12 +634,178 @@ async def safe_sleep(seconds):
         # Минимальная пауза в случае ошибки
         await asyncio.sleep(0.1)
 
+# Функция засчитывания гола
+async def score_goal(message, match_state, caption_body, *, goals_field='your_goals', stat_key=None):
+    """Увеличивает счет и личную статистику, затем отправляет фото гола с текущим счетом"""
+    match_state[goals_field] += 1
+    if stat_key:
+        match_state['stats'][stat_key] += 1
+    await send_photo_with_text(
+        message,
+        'goals',
+        'goal.jpg',
+        f"⚽ ГООООЛ!\n- {caption_body} Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
+    )
+
+# Последние сохраненные состояния матчей по user_id (LRU, не более _MATCH_CACHE_MAX записей)
+_MATCH_CACHE_MAX = 500
+_match_cache: OrderedDict[int, dict] = OrderedDict()
+
+def _cache_match(user_id, match_state):
+    """Запоминает состояние матча пользователя, вытесняя самые старые записи"""
+    _match_cache[user_id] = match_state
+    _match_cache.move_to_end(user_id)
+    if len(_match_cache) > _MATCH_CACHE_MAX:
+        _match_cache.popitem(last=False)
+
+async def clear_match_state(state: FSMContext, *, keep_fsm_state=False):
+    """Очищает состояние пользователя в FSM вместе с закэшированным матчем.
+    С keep_fsm_state=True сбрасывается только match_state, остальные данные и состояние FSM сохраняются"""
+    user_id = state.key.user_id
+    _match_cache.pop(user_id, None)
+    if keep_fsm_state:
+        await state.update_data(match_state=None)
+        return
+    await state.clear()
+    _PLAYING_USERS.discard(user_id)
+
+async def _load_match(callback: types.CallbackQuery, state: FSMContext):
+    """Возвращает состояние матча из кэша, а при промахе - из FSM"""
+    match_state = _match_cache.get(callback.from_user.id)
+    # Кэш действителен, только если кнопка нажата на последнем сообщении матча
+    if match_state is None or match_state.get('last_message_id') != callback.message.message_id:
+        data = await state.get_data()
+        match_state = data.get('match_state', {})
+        _cache_match(callback.from_user.id, match_state)
+    return match_state
+
+# Блокировки пользователей: пока идет обработка момента, новые нажатия отклоняются.
+# Хранится не более _USER_LOCKS_MAX блокировок, вытесняются самые старые свободные
+_USER_LOCKS_MAX = 500
+_user_locks: OrderedDict[int, asyncio.Lock] = OrderedDict()
+
+def _user_lock(user_id):
+    """Возвращает блокировку обработки игровых моментов пользователя"""
+    lock = _user_locks.get(user_id)
+    if lock is not None:
+        _user_locks.move_to_end(user_id)
+        return lock
+    # Вытесняем до вставки, иначе первой свободной оказалась бы только что созданная блокировка
+    if len(_user_locks) >= _USER_LOCKS_MAX:
+        for old_id, old_lock in _user_locks.items():
+            if not old_lock.locked():
+                del _user_locks[old_id]
+                break
+    lock = _user_locks[user_id] = asyncio.Lock()
+    return lock
+
+# Уже обработанные нажатия кнопок (пользователь, сообщение, callback_data) - FIFO, не более _SEEN_CALLBACKS_MAX
+_SEEN_CALLBACKS_MAX = 1000
+_seen_callbacks: OrderedDict[tuple, None] = OrderedDict()
+
+def _callback_key(callback: types.CallbackQuery):
+    return (callback.from_user.id, callback.message.message_id, callback.data)
+
+def _is_duplicate_callback(callback: types.CallbackQuery):
+    """Запоминает нажатие и сообщает, нажималась ли эта кнопка раньше (проверка без await, атомарна для цикла событий)"""
+    key = _callback_key(callback)
+    if key in _seen_callbacks:
+        return True
+    _seen_callbacks[key] = None
+    if len(_seen_callbacks) > _SEEN_CALLBACKS_MAX:
+        _seen_callbacks.popitem(last=False)
+    return False
+
+# Префиксы callback_data кнопок игрового момента
+_MATCH_CALLBACK_PREFIXES = ('action_', 'defense_', 'continue_match_')
+
+class MatchStateMiddleware(BaseMiddleware):
+    """Передает обработчикам игрового момента состояние матча со статистикой и подписями"""
+
+    async def __call__(self, handler, event: types.CallbackQuery, data):
+        if event.data and event.data.startswith(_MATCH_CALLBACK_PREFIXES):
+            match_state = await _load_match(event, data['state'])
+            if match_state:
+                _ensure_stats(match_state)
+                # Подписи не хранятся в FSM и подставляются при загрузке состояния из хранилища
+                if 'captions' not in match_state:
+                    match_state['captions'] = _build_captions(match_state['current_team'], match_state['opponent_team'])
+            data['match_state'] = match_state
+        return await handler(event, data)
+
+dp.callback_query.middleware(MatchStateMiddleware())
+
+class DBSessionMiddleware(BaseMiddleware):
+    """Открывает одну сессию БД на апдейт и передает ее обработчикам как db.
+    Соединение берется из пула только при первом запросе. Обработчики, которые пишут в базу, коммитят сами
+    до ответа пользователю; здесь фиксируется только то, что осталось, а при ошибке транзакция откатывается"""
+
+    async def __call__(self, handler, event, data):
+        async with async_session() as session:
+            data['db'] = session
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await session.rollback()
+                raise
+            if session.in_transaction():
+                await session.commit()
+            return result
+
+dp.message.middleware(DBSessionMiddleware())
+dp.callback_query.middleware(DBSessionMiddleware())
+
+# Сохранение состояния матча в хранилище FSM
+def _persisted_match(match_state):
+    """Состояние матча для FSM без подписей: они однозначно восстанавливаются по названиям команд"""
+    return {key: value for key, value in match_state.items() if key != 'captions'}
+
+async def _commit(state: FSMContext, match_state):
+    """Записывает состояние матча в FSM одним вызовом; завершенный матч уже очищен finish_match и не пишется"""
+    if match_state.get('match_finished'):
+        return
+    _cache_match(state.key.user_id, match_state)
+    await state.update_data(match_state=_persisted_match(match_state))
+
+# Фоновые записи состояния; ссылки держим, чтобы задачи не собрал сборщик мусора
+_pending_writes: set[asyncio.Task] = set()
+
+def _commit_later(state: FSMContext, match_state):
+    """Записывает состояние матча в FSM в фоне, не задерживая ответ пользователю"""
+    if match_state.get('match_finished'):
+        return
+    _cache_match(state.key.user_id, match_state)
+    task = asyncio.create_task(state.update_data(match_state=_persisted_match(match_state)))
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+# Фоновые некритичные запросы к Telegram (например, callback.answer без alert)
+_background_tasks: set[asyncio.Task] = set()
+
+async def _quietly(coro):
+    """Дожидается запроса, ошибки только логируются"""
+    try:
+        await coro
+    except Exception as e:
+        logger.debug(f"Фоновый запрос к Telegram не выполнен: {e}")
+
+def _fire(coro):
+    """Запускает некритичный запрос в фоне, не задерживая следующий шаг обработчика"""
+    task = asyncio.create_task(_quietly(coro))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def _drain_pending_writes():
+    """Дожидается завершения фоновых записей состояния перед остановкой"""
+    if _pending_writes:
+        await asyncio.gather(*_pending_writes, return_exceptions=True)
+
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
 
     try:
         # Сбрасываем все состояния
-        await state.clear()
+        await clear_match_state(state)
         
         # Проверяем подписку
         if not await check_subscription(message.from_user.id):
@@ -387,7 +816,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
             return
         
         # Проверяем, существует ли уже игрок
-        player = await get_player(message.from_user.id)
+        player = await get_player_cached(message.from_user.id)
         if player:
             welcome_text = (
                 f"👋 Привет, {player.name}!\n\n"
@@ -399,13 +828,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
                 "⭐ Стань легендой футбола!"
             )
             try:
-                with open("mbappe.png", "rb") as file:
-                    photo = BufferedInputFile(file.read(), filename="mbappe.png")
-                    await message.answer_photo(
-                        photo,
-                        caption=welcome_text,
-                        reply_markup=get_main_keyboard()
-                    )
+                await send_welcome_photo(message, welcome_text, get_main_keyboard())
             except Exception as photo_error:
                 logger.error(f"Ошибка при отправке фото: {photo_error}")
                 # Если не удалось отправить фото, отправляем только текст
@@ -423,11 +846,11 @@ async def cmd_start(message: types.Message, state: FSMContext):
             reply_markup=get_main_keyboard()
         )
 
-@dp.callback_query(lambda c: c.data == "check_subscription")
+@dp.callback_query(F.data == "check_subscription")
 async def check_subscription_callback(callback: types.CallbackQuery):
     # Сбрасываем все состояния
     state = dp.current_state(user=callback.from_user.id)
-    await state.clear()
+    await clear_match_state(state)
     
     if await check_subscription(callback.from_user.id):
         await callback.message.answer(
@@ -472,9 +895,9 @@ async def process_name(message: types.Message, state: FSMContext):
             "Произошла ошибка при обработке имени. Пожалуйста, попробуйте снова.",
             reply_markup=get_main_keyboard()
         )
-        await state.clear()
+        await clear_match_state(state)
 
-@dp.callback_query(lambda c: c.data.startswith('position_'), GameStates.waiting_position)
+@dp.callback_query(F.data.startswith("position_"), GameStates.waiting_position)
 async def process_position(callback: types.CallbackQuery, state: FSMContext):
     try:
         position_map = {
@@ -501,7 +924,7 @@ async def process_position(callback: types.CallbackQuery, state: FSMContext):
                 "Произошла ошибка. Пожалуйста, начните сначала.",
                 reply_markup=get_main_keyboard()
             )
-            await state.clear()
+            await clear_match_state(state)
             return
         
         logger.info(f"Игрок {name} (ID: {callback.from_user.id}) выбрал позицию: {position}")
@@ -537,14 +960,14 @@ async def process_position(callback: types.CallbackQuery, state: FSMContext):
             "Произошла ошибка при выборе позиции. Пожалуйста, попробуйте снова.",
             reply_markup=get_main_keyboard()
         )
-        await state.clear()
+        await clear_match_state(state)
 
 def get_initial_player_date():
     """Определяет начальную дату для нового игрока"""
     # Всегда возвращаем фиксированную дату начала сезона в формате DD.MM.YYYY
     return SEASON_START_DATE
 
-@dp.callback_query(lambda c: c.data.startswith('choose_club_'), GameStates.waiting_club_choice)
+@dp.callback_query(F.data.startswith("choose_club_"), GameStates.waiting_club_choice)
 async def process_club_choice(callback_query: types.CallbackQuery, state: FSMContext):
     try:
         # Получаем выбранный клуб
@@ -574,7 +997,7 @@ async def process_club_choice(callback_query: types.CallbackQuery, state: FSMCon
             logger.info(f"Игрок успешно создан: {name}")
             
             # Сбрасываем все состояния
-            await state.clear()
+            await clear_match_state(state)
             
             # Создаем персональный календарь
             calendar = create_player_calendar(club)
@@ -592,13 +1015,7 @@ async def process_club_choice(callback_query: types.CallbackQuery, state: FSMCon
                 "⭐ Стань легендой футбола!"
             )
             
-            with open("mbappe.png", "rb") as file:
-                photo = BufferedInputFile(file.read(), filename="mbappe.png")
-                await callback_query.message.answer_photo(
-                    photo,
-                    caption=welcome_text,
-                    reply_markup=get_main_menu_keyboard()
-                )
+            await send_welcome_photo(callback_query.message, welcome_text, get_main_menu_keyboard())
             logger.info(f"Отправлено приветственное сообщение игроку {name}")
             
         except Exception as e:
@@ -608,7 +1025,7 @@ async def process_club_choice(callback_query: types.CallbackQuery, state: FSMCon
                 reply_markup=get_main_menu_keyboard()
             )
             # Сбрасываем состояние, чтобы можно было начать заново
-            await state.clear()
+            await clear_match_state(state)
             
     except Exception as e:
         logger.error(f"Неожиданная ошибка в process_club_choice: {e}")
@@ -616,7 +1033,7 @@ async def process_club_choice(callback_query: types.CallbackQuery, state: FSMCon
             "Произошла непредвиденная ошибка. Пожалуйста, попробуйте снова.",
             reply_markup=get_main_menu_keyboard()
         )
-        await state.clear()
+        await clear_match_state(state)
 
 async def get_virtual_date(player):
     """Получает виртуальную дату игрока в формате DD.MM.YYYY"""
@@ -703,8 +1120,9 @@ async def can_play_match(player, in_day=False):
         logger.error(f"Ошибка при проверке возможности сыграть матч: {e}")
         return False, "Произошла ошибка. Попробуйте позже."
 
-async def advance_virtual_date(player):
-    """Увеличивает виртуальную дату на 7 дней, с учетом зимнего перерыва и смены года. Новый сезон только после мая."""
+async def advance_virtual_date(player, **updates):
+    """Увеличивает виртуальную дату на 7 дней, с учетом зимнего перерыва и смены года. Новый сезон только после мая.
+    Дополнительные поля updates записываются в том же UPDATE, что и новая дата."""
     try:
         # Определяем формат даты и парсим текущую дату
         if "-" in player.last_match_date:
@@ -725,159 +1143,152 @@ async def advance_virtual_date(player):
         if new_date.year > current_date.year:
             logger.info(f"Смена года: {current_date.year} -> {new_date.year}")
         
+        current_day = (current_date.month, current_date.day)
+        new_day = (new_date.month, new_date.day)
+        
         # Проверяем, не наступил ли зимний перерыв
-        if not is_winter_break(current_date) and is_winter_break(new_date):
+        if current_day < _WINTER_BREAK_ENTRY <= new_day:
             logger.info(f"Наступил зимний перерыв для игрока {player.name}")
-            # Если переходим на зимний перерыв, сдвигаем дату сразу после него
-            if new_date.month == WINTER_BREAK_START:  # Декабрь
-                # Переходим на март следующего года (конец зимнего перерыва)
-                new_date = datetime(new_date.year + 1, WINTER_BREAK_END, 1)
-            else:
-                # Если уже в начале года, просто переходим на март
-                new_date = datetime(new_date.year, WINTER_BREAK_END, 1)
+            # Переходим на март следующего года (конец зимнего перерыва)
+            new_date = datetime(new_date.year + 1, WINTER_BREAK_END, 1)
             # После зимнего перерыва сезон продолжается, не вызываем start_new_season
         
         # Проверяем, не закончился ли сезон (после мая)
-        if (current_date.month < SEASON_END_MONTH or 
-            (current_date.month == SEASON_END_MONTH and current_date.day < 25)) and \
-           (new_date.month > SEASON_END_MONTH or 
-            (new_date.month == SEASON_END_MONTH and new_date.day >= 25)):
+        if current_day < _SEASON_END_CUTOFF <= new_day:
             logger.info(f"Сезон закончился для игрока {player.name}")
             # Генерируем предложения о переходе
-            await generate_transfer_offers(player)
+            await generate_transfer_offers(player, current_date.month)
             # Переходим на следующий сезон (сентябрь)
             new_date = datetime(new_date.year, SEASON_START_MONTH, 1)
             # Создаем новый календарь для следующего сезона
             await start_new_season(player)
+            # Новый сезон начинается с первого тура - не перезаписываем его
+            updates.pop('current_round', None)
         
         # Форматируем новую дату для сохранения
-        virtual_date = new_date.strftime("%d.%m.%Y")
+        virtual_date = f"{new_date.day:02d}.{new_date.month:02d}.{new_date.year:04d}"
         
         # Обновляем информацию игрока
         await update_player_stats(
             user_id=player.user_id,
-            last_match_date=virtual_date
+            last_match_date=virtual_date,
+            **updates
         )
         
         logger.info(f"Обновлена виртуальная дата для игрока {player.name}: {virtual_date}")
         return virtual_date
-    except Exception as e:
+    except (ValueError, TypeError) as e:
         logger.error(f"Ошибка при обновлении виртуальной даты: {e}")
+        # Дата не изменилась, но остальные поля все равно сохраняем
+        if updates:
+            await update_player_stats(player.user_id, **updates)
         return player.last_match_date
 
 async def get_opponent_by_round(player, current_round):
     """Получает соперника по текущему туру из персонального календаря игрока"""
-    try:
-        if not player:
-            logger.error("Передан пустой объект игрока")
+    if not player:
+        logger.error("Передан пустой объект игрока")
+        return None
+        
+    # Проверяем наличие календаря
+    personal_calendar = getattr(player, 'personal_calendar', None)
+    if not personal_calendar:
+        logger.warning(f"У игрока {player.name} (ID: {player.user_id}) отсутствует календарь, создаем новый")
+        # Создаем новый календарь
+        calendar_json = create_player_calendar(player.club)
+        if not calendar_json:
+            logger.error(f"Не удалось создать календарь для клуба {player.club}")
             return None
             
-        # Проверяем наличие календаря
-        if not hasattr(player, 'personal_calendar') or not player.personal_calendar:
-            logger.warning(f"У игрока {player.name} (ID: {player.user_id}) отсутствует календарь, создаем новый")
-            # Создаем новый календарь
-            calendar_json = create_player_calendar(player.club)
-            if not calendar_json:
-                logger.error(f"Не удалось создать календарь для клуба {player.club}")
-                return None
-                
-            # Сохраняем календарь в базу
-            try:
-                await update_player_stats(
-                    user_id=player.user_id,
-                    personal_calendar=calendar_json
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при сохранении календаря: {e}")
-                return None
-                
-            # Используем обычного соперника до следующего обновления
-            return get_opponent_by_round_default(player.club, current_round)
-        
+        # Сохраняем календарь в базу
         try:
-            # Парсим JSON календарь
-            calendar = json.loads(player.personal_calendar)
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка при парсинге календаря игрока {player.name}: {e}")
-            # Создаем новый календарь при ошибке парсинга
-            calendar_json = create_player_calendar(player.club)
-            if not calendar_json:
-                return None
             await update_player_stats(
                 user_id=player.user_id,
                 personal_calendar=calendar_json
             )
-            return get_opponent_by_round_default(player.club, current_round)
-        
-        # Проверяем, не вышли ли за пределы календаря (18 туров)
-        if current_round > 18:
-            logger.warning(f"Запрошен тур {current_round}, но в календаре максимум 18 туров")
-            # Если сезон закончился, возвращаем None, чтобы можно было начать новый сезон
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении календаря: {e}")
             return None
             
-        # Ищем матч текущего тура
-        for match in calendar:
-            if match["round"] == current_round:
-                logger.info(f"Матч тура {current_round} найден в календаре игрока {player.name}: {match}")
-                return match["opponent"]
-        
-        # Если матч не найден, выводим предупреждение
-        logger.warning(f"В календаре игрока {player.name} не найден матч для тура {current_round}")
+        # Используем обычного соперника до следующего обновления
+        return get_opponent_by_round_default(player.club, current_round)
+    
+    try:
+        # Парсим JSON календарь
+        calendar = json_loads(personal_calendar)
+    except json.JSONDecodeError as e:
+        logger.error(f"Ошибка при парсинге календаря игрока {player.name}: {e}")
+        # Создаем новый календарь при ошибке парсинга
+        calendar_json = create_player_calendar(player.club)
+        if not calendar_json:
+            return None
+        await update_player_stats(
+            user_id=player.user_id,
+            personal_calendar=calendar_json
+        )
+        return get_opponent_by_round_default(player.club, current_round)
+    
+    # Проверяем, не вышли ли за пределы календаря (18 туров)
+    if current_round > 18:
+        logger.warning(f"Запрошен тур {current_round}, но в календаре максимум 18 туров")
+        # Если сезон закончился, возвращаем None, чтобы можно было начать новый сезон
+        return None
         
-        # Пытаемся подобрать случайного соперника
+    # Ищем матч текущего тура
+    for match in calendar:
+        if match["round"] == current_round:
+            logger.info(f"Матч тура {current_round} найден в календаре игрока {player.name}: {match}")
+            return match["opponent"]
+    
+    # Если матч не найден, выводим предупреждение
+    logger.warning(f"В календаре игрока {player.name} не найден матч для тура {current_round}")
+    
+    # Пытаемся подобрать случайного соперника
+    random_opponent = random.choice(list(FNL_SILVER_CLUBS.keys()))
+    while random_opponent == player.club:
         random_opponent = random.choice(list(FNL_SILVER_CLUBS.keys()))
-        while random_opponent == player.club:
-            random_opponent = random.choice(list(FNL_SILVER_CLUBS.keys()))
-        
-        logger.warning(f"Для клуба {player.club} в туре {current_round} не найден соперник в календаре - выбран случайный клуб {random_opponent}")
-        return random_opponent
-    except Exception as e:
-        logger.error(f"Критическая ошибка при получении соперника из календаря: {e}")
-        # В случае ошибки используем обычный способ
-        return get_opponent_by_round_default(player.club, current_round)
+    
+    logger.warning(f"Для клуба {player.club} в туре {current_round} не найден соперник в календаре - выбран случайный клуб {random_opponent}")
+    return random_opponent
 
 # Функция для генерации предложений о переходе
-async def generate_transfer_offers(player):
+async def generate_transfer_offers(player, current_month):
     """Генерирует случайные предложения о переходе в другие клубы в конце сезона"""
     try:
         # Генерируем предложения только в конце сезона (если май)
-        current_date = datetime.strptime(player.last_match_date, "%d.%m.%Y")
-        if current_date.month != SEASON_END_MONTH:
+        if current_month != SEASON_END_MONTH:
             return
             
         logger.info(f"Игроку {player.name} (ID: {player.user_id}) поступили предложения о переходе")
         
         # Выбираем 3 случайных клуба, кроме текущего
-        available_clubs = [club for club in FNL_SILVER_CLUBS.keys() if club != player.club]
-        if len(available_clubs) < 3:
-            offer_clubs = available_clubs
-        else:
-            offer_clubs = random.sample(available_clubs, 3)
-        
-        # Создаем предложения
-        offers = []
-        for club in offer_clubs:
-            # Случайная зарплата, немного выше текущей
-            salary_increase = random.uniform(1.1, 1.5)
-            new_salary = int(player.salary * salary_increase)
-            
-            offers.append({
+        pool = _CLUBS_BY_CLUB.get(player.club, _SILVER_CLUB_NAMES)
+        offer_clubs = random.sample(pool, min(3, len(pool)))
+        
+        # Создаем предложения: случайная зарплата немного выше текущей и рейтинг клуба
+        offers = [
+            {
                 "club": club,
-                "salary": new_salary,
-                "stars": FNL_SILVER_CLUBS.get(club, 1)  # Рейтинг клуба
-            })
+                "salary": int(player.salary * random.uniform(1.1, 1.5)),
+                "stars": FNL_SILVER_CLUBS[club]
+            }
+            for club in offer_clubs
+        ]
         
         # Сохраняем предложения в базе данных
         await update_player_stats(
             user_id=player.user_id,
-            transfer_offers=json.dumps(offers)
+            transfer_offers=json_dumps(offers)
         )
         
         return offers
-    except Exception as e:
+    except (ValueError, AttributeError) as e:
         logger.error(f"Ошибка при генерации предложений о переходе: {e}")
         return []
 
+# Матч общего календаря: хозяева, гости и номер тура
+Match = namedtuple('Match', 'home away round_num')
+
 # Создаем календарь матчей
 def create_calendar():
     """
@@ -905,7 +1316,7 @@ def create_calendar():
         # Выбираем первые 9 туров для первого круга
         rounds_per_circle = 9
     
-    # Календарь будет списком кортежей (home_team, away_team, round_number)
+    # Календарь будет списком матчей Match(home, away, round_num)
     calendar = []
     
     # Алгоритм создания кругового турнира (алгоритм Бержа)
@@ -924,9 +1335,9 @@ def create_calendar():
             if home_team != "Выходной" and away_team != "Выходной":
                 # Нечетные туры - первая команда дома, четные - в гостях
                 if round_num % 2 == 1:
-                    round_matches.append((home_team, away_team, round_num))
+                    round_matches.append(Match(home_team, away_team, round_num))
                 else:
-                    round_matches.append((away_team, home_team, round_num))
+                    round_matches.append(Match(away_team, home_team, round_num))
         
         # Добавляем матчи этого тура в общий календарь
         calendar.extend(round_matches)
@@ -938,12 +1349,13 @@ def create_calendar():
     first_round_calendar = calendar.copy()
     for home, away, round_num in first_round_calendar:
         # Второй круг начинается после первого (round_num + rounds_per_circle)
-        calendar.append((away, home, round_num + rounds_per_circle))
+        calendar.append(Match(away, home, round_num + rounds_per_circle))
     
     # Сортируем по номеру тура для удобства
-    calendar.sort(key=lambda match: match[2])
+    calendar.sort(key=lambda match: match.round_num)
     
-    return calendar
+    # Календарь неизменяемый - замораживаем его в кортеж
+    return tuple(calendar)
 
 # Глобальный календарь матчей
 MATCH_CALENDAR = create_calendar()
@@ -959,32 +1371,32 @@ def get_opponent_by_round_default(player_club, current_round):
     match = MATCH_CALENDAR[current_round - 1]
     
     # Проверяем, участвует ли клуб игрока в матче
-    if match[0] == player_club:
-        logger.info(f"Клуб {player_club} играет в туре {current_round} против {match[1]}")
-        return match[1]  # Соперник - вторая команда
-    elif match[1] == player_club:
-        logger.info(f"Клуб {player_club} играет в туре {current_round} против {match[0]}")
-        return match[0]  # Соперник - первая команда
+    if match.home == player_club:
+        logger.info(f"Клуб {player_club} играет в туре {current_round} против {match.away}")
+        return match.away  # Соперник - вторая команда
+    elif match.away == player_club:
+        logger.info(f"Клуб {player_club} играет в туре {current_round} против {match.home}")
+        return match.home  # Соперник - первая команда
     
     # Если клуб игрока не участвует в этом туре, ищем следующий матч
     for i in range(current_round, len(MATCH_CALENDAR)):
         match = MATCH_CALENDAR[i]
-        if match[0] == player_club:
-            logger.info(f"Для клуба {player_club} в туре {current_round} найден соперник {match[1]} в будущем туре {i+1}")
-            return match[1]
-        elif match[1] == player_club:
-            logger.info(f"Для клуба {player_club} в туре {current_round} найден соперник {match[0]} в будущем туре {i+1}")
-            return match[0]
+        if match.home == player_club:
+            logger.info(f"Для клуба {player_club} в туре {current_round} найден соперник {match.away} в будущем туре {i+1}")
+            return match.away
+        elif match.away == player_club:
+            logger.info(f"Для клуба {player_club} в туре {current_round} найден соперник {match.home} в будущем туре {i+1}")
+            return match.home
     
     # Если в этом сезоне больше нет матчей, ищем в начале календаря
     for i in range(current_round - 1):
         match = MATCH_CALENDAR[i]
-        if match[0] == player_club:
-            logger.info(f"Для клуба {player_club} в туре {current_round} найден соперник {match[1]} в прошлом туре {i+1}")
-            return match[1]
-        elif match[1] == player_club:
-            logger.info(f"Для клуба {player_club} в туре {current_round} найден соперник {match[0]} в прошлом туре {i+1}")
-            return match[0]
+        if match.home == player_club:
+            logger.info(f"Для клуба {player_club} в туре {current_round} найден соперник {match.away} в прошлом туре {i+1}")
+            return match.away
+        elif match.away == player_club:
+            logger.info(f"Для клуба {player_club} в туре {current_round} найден соперник {match.home} в прошлом туре {i+1}")
+            return match.home
     
     # Если соперник все еще не найден, возвращаем случайную команду (кроме клуба игрока)
     all_clubs = list(FNL_SILVER_CLUBS.keys())
@@ -1011,7 +1423,7 @@ async def play_match_callback(callback: types.CallbackQuery, state: FSMContext):
             return
             
         # Получаем данные игрока
-        player = await get_player(user_id)
+        player = await get_player_cached(user_id)
         if not player:
             logger.error(f"Игрок не найден для пользователя {user_id}")
             await callback.answer("Ошибка: игрок не найден. Пожалуйста, начните игру заново с помощью команды /start")
@@ -1032,17 +1444,13 @@ async def play_match_callback(callback: types.CallbackQuery, state: FSMContext):
         opponent = await get_opponent_by_round(player, current_round)
         if not opponent:
             logger.info(f"Сезон закончен для игрока {player.name}, начинаем новый сезон")
-            if not await start_new_season(player):
+            # start_new_season возвращает уже обновленного игрока
+            new_season_player = await start_new_season(player)
+            if not new_season_player:
                 logger.error(f"Не удалось начать новый сезон для игрока {player.name}")
                 await callback.answer("Ошибка при начале нового сезона")
                 return
-                
-            # Получаем обновленные данные игрока после начала нового сезона
-            player = await get_player(user_id)
-            if not player:
-                logger.error(f"Игрок не найден после начала нового сезона (user_id: {user_id})")
-                await callback.answer("Ошибка: игрок не найден. Пожалуйста, начните игру заново с помощью команды /start")
-                return
+            player = new_season_player
                 
             # Получаем соперника для нового сезона
             opponent = await get_opponent_by_round(player, 1)
@@ -1071,7 +1479,6 @@ async def play_match_callback(callback: types.CallbackQuery, state: FSMContext):
             'current_team': player.club,
             'opponent_team': opponent_team,
             'current_round': player.current_round,
-            'is_processing': False,
             'is_home': True,  # По умолчанию домашний матч
             'player_id': user_id,
             'player_name': player.name,
@@ -1079,15 +1486,7 @@ async def play_match_callback(callback: types.CallbackQuery, state: FSMContext):
             'player_position': player.position,
             'score': {'home': 0, 'away': 0},
             'stats': {
-                "goals": 0,
-                "assists": 0,
-                "saves": 0,
-                "tackles": 0,
-                "fouls": 0,
-                "passes": 0,
-                "interceptions": 0,
-                "clearances": 0,
-                "throws": 0,
+                **_DEFAULT_STATS,
                 'shots': {'home': 0, 'away': 0},
                 'shots_on_target': {'home': 0, 'away': 0},
                 'possession': {'home': 50, 'away': 50},
@@ -1106,25 +1505,24 @@ async def play_match_callback(callback: types.CallbackQuery, state: FSMContext):
     except Exception as e:
         logger.error(f"Критическая ошибка в play_match_callback: {e}")
         await callback.message.answer("Произошла ошибка при начале матча. Пожалуйста, попробуйте снова.")
-        await state.clear()
+        await clear_match_state(state)
 
-@dp.callback_query(lambda c: c.data.startswith('action_'))
-async def handle_action(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    match_state = data.get('match_state', {})
+# Кнопки после дриблинга обрабатываются своими обработчиками (ниже), а не общим handle_action
+@dp.callback_query(F.data.startswith("action_") & ~F.data.endswith("_after_dribble"))
+async def handle_action(callback: types.CallbackQuery, match_state, state: FSMContext):
     if match_state.get('match_finished', False) or match_state.get('minute', 0) >= 90:
         await callback.answer("Матч завершён. Нажмите 'Играть матч' для нового матча.", show_alert=True)
         return
-    if data.get('is_processing', False):
+    lock = _user_lock(callback.from_user.id)
+    if lock.locked():
         await callback.answer("Дождитесь завершения текущего момента", show_alert=True)
         return
-    await state.update_data(is_processing=True)
-    try:
+    async with lock:
         action = callback.data.split('_')[1]
         if match_state.get('position') == 'Вратарь':
             await handle_goalkeeper_save(callback, match_state, state)
         elif match_state.get('position') == 'Защитник':
-            await handle_defense_action(callback, match_state, state)
+            await _dispatch_defense_action(callback, match_state, state)
         elif match_state.get('position') == 'Нападающий':
             if action == 'shot':
                 await handle_forward_shot(callback, match_state, state)
@@ -1132,236 +1530,210 @@ async def handle_action(callback: types.CallbackQuery, state: FSMContext):
                 await handle_forward_pass(callback, match_state, state)
             elif action == 'dribble':
                 await handle_forward_dribble(callback, match_state, state)
-    finally:
-        await state.update_data(is_processing=False)
 
-@dp.callback_query(lambda c: c.data.startswith('defense_'))
+@dp.callback_query(F.data.startswith("defense_"))
 async def handle_defense_action(callback: types.CallbackQuery, match_state, state: FSMContext):
-    data = await state.get_data()
-    match_state = data.get('match_state', match_state)
     if match_state.get('match_finished', False) or match_state.get('minute', 0) >= 90:
         await callback.answer("Матч завершён. Нажмите 'Играть матч' для нового матча.", show_alert=True)
         return
-    if data.get('is_processing', False):
+    lock = _user_lock(callback.from_user.id)
+    if lock.locked():
         await callback.answer("Дождитесь завершения текущего момента", show_alert=True)
         return
-    await state.update_data(is_processing=True)
-    try:
-        action = callback.data[8:]
-        if action == "tackle":
-            await handle_defender_tackle(callback, match_state, state)
-        elif action == "block":
-            await handle_defender_block(callback, match_state, state)
-        elif action == "pass_left":
-            await handle_defender_pass_left(callback, match_state, state)
-        elif action == "pass_right":
-            await handle_defender_pass_right(callback, match_state, state)
-        elif action == "clear":
-            await handle_defender_clearance(callback, match_state, state)
-    finally:
-        await state.update_data(is_processing=False)
+    async with lock:
+        await _dispatch_defense_action(callback, match_state, state)
+
+async def _dispatch_defense_action(callback: types.CallbackQuery, match_state, state: FSMContext):
+    """Вызывает обработчик действия защитника; блокировку пользователя держит вызывающий"""
+    action = callback.data[8:]
+    if action == "tackle":
+        await handle_defender_tackle(callback, match_state, state)
+    elif action == "block":
+        await handle_defender_block(callback, match_state, state)
+    elif action == "pass_left":
+        await handle_defender_pass_left(callback, match_state, state)
+    elif action == "pass_right":
+        await handle_defender_pass_right(callback, match_state, state)
+    elif action == "clear":
+        await handle_defender_clearance(callback, match_state, state)
 
 # Функция для обработки игрового момента
 async def handle_goalkeeper_save(callback: types.CallbackQuery, match_state, state: FSMContext):
     action = callback.data.split('_')[1]
-    try:
-        # Проверяем наличие необходимых полей статистики
-        if 'stats' not in match_state:
-            match_state['stats'] = {
-                "goals": 0,
-                "assists": 0,
-                "saves": 0,
-                "tackles": 0,
-                "fouls": 0,
-                "passes": 0,
-                "interceptions": 0,
-                "clearances": 0,
-                "throws": 0
-            }
-            
-        # Первая фаза - реакция на удар
-        if action in ['rush', 'left', 'right']:
+    stats = match_state['stats']
+        
+    # Первая фаза - реакция на удар
+    if action in ['rush', 'left', 'right']:
+        await send_photo_with_text(
+            callback.message,
+            'defense',
+            'save.jpg',
+            match_state['captions']['gk_save']
+        )
+        if ANIM_DELAY:
+            await asyncio.sleep(ANIM_DELAY)
+        
+        # Случайно определяем направление удара
+        shot_direction = random.choice(['rush', 'left', 'right'])
+        
+        if action == shot_direction:  # Угадал направление
+            stats['saves'] += 1
             await send_photo_with_text(
                 callback.message,
                 'defense',
-                'save.jpg',
-                f"🖐️ {match_state['current_team']} в опасности!\n- Вратарь готовится к спасению"
+                'save_success.jpg',
+                "✅ Отличный сейв!\n- Вратарь угадал направление удара"
             )
-            await asyncio.sleep(2)
-            
-            # Случайно определяем направление удара
-            shot_direction = random.choice(['rush', 'left', 'right'])
+            # Показываем второй набор действий
+            message = await callback.message.answer(
+                "Мяч у вратаря. Выберите следующее действие:",
+                reply_markup=get_match_actions_keyboard(match_state['position'], is_second_phase=True)
+            )
+            # Сохраняем ID сообщения с кнопками второго этапа
+            match_state['last_message_id'] = message.message_id
+            match_state['waiting_second_action'] = True
+            await _commit(state, match_state)
+            return
+        else:  # Не угадал направление
+            await send_photo_with_text(
+                callback.message,
+                'defense',
+                'save_fail.jpg',
+                "❌ Вратарь не угадал направление удара!"
+            )
+            if ANIM_DELAY:
+                await asyncio.sleep(ANIM_DELAY)
             
-            if action == shot_direction:  # Угадал направление
-                match_state['stats']['saves'] = match_state['stats'].get('saves', 0) + 1
+            # Шанс на спасение через защитников
+            defender_save = random.random()
+            if defender_save < 0.4:  # 40% шанс что защитники помогут
+                stats['tackles'] += 1
                 await send_photo_with_text(
                     callback.message,
                     'defense',
-                    'save_success.jpg',
-                    "✅ Отличный сейв!\n- Вратарь угадал направление удара"
-                )
-                # Показываем второй набор действий
-                message = await callback.message.answer(
-                    "Мяч у вратаря. Выберите следующее действие:",
-                    reply_markup=get_match_actions_keyboard(match_state['position'], is_second_phase=True)
+                    'tackle_success.jpg',
+                    "✅ Защитники подстраховали!\n- Мяч выбит в безопасную зону"
                 )
-                # Сохраняем ID сообщения с кнопками второго этапа
-                match_state['last_message_id'] = message.message_id
-                await state.update_data(match_state=match_state)
-                match_state['waiting_second_action'] = True
-                await state.update_data(match_state=match_state)
-                return
-            else:  # Не угадал направление
+                await continue_match(callback, match_state, state)
+            elif defender_save < 0.7:  # 30% шанс что мяч уйдет на угловой
                 await send_photo_with_text(
                     callback.message,
                     'defense',
-                    'save_fail.jpg',
-                    "❌ Вратарь не угадал направление удара!"
+                    'deflect.jpg',
+                    "↪️ Защитники заблокировали удар!\n- Мяч ушел на угловой"
                 )
-                await asyncio.sleep(2)
-                
-                # Шанс на спасение через защитников
-                defender_save = random.random()
-                if defender_save < 0.4:  # 40% шанс что защитники помогут
-                    match_state['stats']['tackles'] = match_state['stats'].get('tackles', 0) + 1
-                    await send_photo_with_text(
-                        callback.message,
-                        'defense',
-                        'tackle_success.jpg',
-                        "✅ Защитники подстраховали!\n- Мяч выбит в безопасную зону"
-                    )
-                    await continue_match(callback, match_state, state)
-                elif defender_save < 0.7:  # 30% шанс что мяч уйдет на угловой
-                    await send_photo_with_text(
-                        callback.message,
-                        'defense',
-                        'deflect.jpg',
-                        "↪️ Защитники заблокировали удар!\n- Мяч ушел на угловой"
-                    )
-                    await continue_match(callback, match_state, state)
-        
-        # Вторая фаза - действие с мячом после сейва
-        elif action in ['kick', 'throw']:
-            if not match_state.get('waiting_second_action'):
-                await callback.answer("Сначала нужно спасти ворота!", show_alert=True)
-                return
-                
-            if action == 'kick':
+                await continue_match(callback, match_state, state)
+    
+    # Вторая фаза - действие с мячом после сейва
+    elif action in ['kick', 'throw']:
+        if not match_state.get('waiting_second_action'):
+            await callback.answer("Сначала нужно спасти ворота!", show_alert=True)
+            return
+            
+        if action == 'kick':
+            await send_photo_with_text(
+                callback.message,
+                'goalkeeper',
+                'kick_start.jpg',
+                match_state['captions']['gk_kick']
+            )
+            if ANIM_DELAY:
+                await asyncio.sleep(ANIM_DELAY)
+            
+            if random.random() < 0.7:
                 await send_photo_with_text(
                     callback.message,
                     'goalkeeper',
-                    'kick_start.jpg',
-                    f"⚽ {match_state['current_team']} с мячом\n- Вратарь готовится выбить мяч"
+                    'kick_success.jpg',
+                    "✅ Мяч выбит!\n- Вратарь далеко выбил мяч в поле"
                 )
-                await asyncio.sleep(2)
-                
-                if random.random() < 0.7:
-                    await send_photo_with_text(
-                        callback.message,
-                        'goalkeeper',
-                        'kick_success.jpg',
-                        "✅ Мяч выбит!\n- Вратарь далеко выбил мяч в поле"
-                    )
-                else:
-                    await send_photo_with_text(
-                        callback.message,
-                        'goalkeeper',
-                        'kick_fail.jpg',
-                        "❌ Неудачный выбив\n- Мяч перехвачен соперником"
-                    )
-                    await simulate_opponent_attack(callback, match_state)
-            else:  # throw
+            else:
                 await send_photo_with_text(
                     callback.message,
                     'goalkeeper',
-                    'throw_start.jpg',
-                    f"🎯 {match_state['current_team']} с мячом\n- Вратарь готовится к выбросу мяча"
+                    'kick_fail.jpg',
+                    "❌ Неудачный выбив\n- Мяч перехвачен соперником"
                 )
-                await asyncio.sleep(2)
-                
-                if random.random() < 0.8:
-                    match_state['stats']['throws'] = match_state['stats'].get('throws', 0) + 1
-                    await send_photo_with_text(
-                        callback.message,
-                        'goalkeeper',
-                        'throw_success.jpg',
-                        "✅ Отличный выброс!\n- Вратарь точно выбросил мяч партнеру"
-                    )
-                else:
-                    await send_photo_with_text(
-                        callback.message,
-                        'goalkeeper',
-                        'throw_fail.jpg',
-                        "❌ Неудачный выброс\n- Мяч перехвачен соперником"
-                    )
-                    await simulate_opponent_attack(callback, match_state)
+                await simulate_opponent_attack(callback, match_state)
+        else:  # throw
+            await send_photo_with_text(
+                callback.message,
+                'goalkeeper',
+                'throw_start.jpg',
+                match_state['captions']['gk_throw']
+            )
+            if ANIM_DELAY:
+                await asyncio.sleep(ANIM_DELAY)
             
-            # Сбрасываем флаг ожидания второго действия
-            match_state['waiting_second_action'] = False
-            await state.update_data(match_state=match_state)
-            await continue_match(callback, match_state, state)
-    finally:
-        # Сбрасываем флаг обработки в любом случае
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
+            if random.random() < 0.8:
+                stats['throws'] += 1
+                await send_photo_with_text(
+                    callback.message,
+                    'goalkeeper',
+                    'throw_success.jpg',
+                    "✅ Отличный выброс!\n- Вратарь точно выбросил мяч партнеру"
+                )
+            else:
+                await send_photo_with_text(
+                    callback.message,
+                    'goalkeeper',
+                    'throw_fail.jpg',
+                    "❌ Неудачный выброс\n- Мяч перехвачен соперником"
+                )
+                await simulate_opponent_attack(callback, match_state)
+        
+        # Сбрасываем флаг ожидания второго действия (состояние сохранит continue_match)
+        match_state['waiting_second_action'] = False
+        await continue_match(callback, match_state, state)
+
+# Клавиатуры защитника статичны, поэтому создаются один раз при загрузке модуля
+_DEFENDER_DEFENSE_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🛡️ Отбор мяча", callback_data="defense_tackle")],
+    [InlineKeyboardButton(text="🚫 Поставить блок", callback_data="defense_block")]
+])
+
+_DEFENDER_AFTER_DEFENSE_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="⬅️ Отдать влево", callback_data="defense_pass_left")],
+    [InlineKeyboardButton(text="⚽ Выбить", callback_data="defense_clear")],
+    [InlineKeyboardButton(text="➡️ Отдать вправо", callback_data="defense_pass_right")]
+])
 
 def get_defender_defense_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🛡️ Отбор мяча", callback_data="defense_tackle")],
-        [InlineKeyboardButton(text="🚫 Поставить блок", callback_data="defense_block")]
-    ])
+    return _DEFENDER_DEFENSE_KB
 
 def get_defender_after_defense_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⬅️ Отдать влево", callback_data="defense_pass_left")],
-        [InlineKeyboardButton(text="⚽ Выбить", callback_data="defense_clear")],
-        [InlineKeyboardButton(text="➡️ Отдать вправо", callback_data="defense_pass_right")]
-    ])
+    return _DEFENDER_AFTER_DEFENSE_KB
 
 async def handle_defender_tackle(callback: types.CallbackQuery, match_state, state: FSMContext):
     try:
-        # Проверяем наличие необходимых полей статистики
-        if 'stats' not in match_state:
-            match_state['stats'] = {
-                "goals": 0,
-                "assists": 0,
-                "saves": 0,
-                "tackles": 0,
-                "fouls": 0,
-                "passes": 0,
-                "interceptions": 0,
-                "clearances": 0,
-                "throws": 0
-            }
+        stats = match_state['stats']
             
         await send_photo_with_text(
             callback.message,
             'defense',
             'tackle.jpg',
-            f"🛡️ {match_state['current_team']} в защите\n- Защитник готовится к отбору мяча"
+            match_state['captions']['def_tackle']
         )
-        await asyncio.sleep(3)
+        if ANIM_DELAY:
+            await asyncio.sleep(ANIM_DELAY * 1.5)
         
         if random.random() < 0.6:
-            match_state['stats']['tackles'] = match_state['stats'].get('tackles', 0) + 1
-            await send_photo_with_text(
-                callback.message,
-                'defense',
-                'tackle_success.jpg',
-                "✅ Отличный отбор!\n- Защитник успешно отобрал мяч\n\nВыберите следующее действие:"
-            )
+            stats['tackles'] += 1
             # Сохраняем состояние успешного отбора
             match_state['defense_success'] = True
-            await state.update_data(match_state=match_state)
             
-            # Показываем клавиатуру с вариантами действий после отбора
-            message = await callback.message.answer(
-                "Что будете делать с мячом?",
+            # Фото отбора сразу несет клавиатуру с вариантами действий после отбора
+            message = await send_photo_with_text(
+                callback.message,
+                'defense',
+                'tackle_success.jpg',
+                "✅ Отличный отбор!\n- Защитник успешно отобрал мяч\n\nЧто будете делать с мячом?",
                 reply_markup=get_defender_after_defense_keyboard()
             )
             # Сохраняем ID сообщения с кнопками
-            match_state['last_message_id'] = message.message_id
-            await state.update_data(match_state=match_state)
+            if message:
+                match_state['last_message_id'] = message.message_id
+            await _commit(state, match_state)
         else:
             await send_photo_with_text(
                 callback.message,
@@ -1371,60 +1743,38 @@ async def handle_defender_tackle(callback: types.CallbackQuery, match_state, sta
             )
             await simulate_opponent_attack(callback, match_state)
             await continue_match(callback, match_state, state)
-    except Exception as e:
+    except (KeyError, TelegramBadRequest) as e:
         print(f"Error in handle_defender_tackle: {e}")
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
         await callback.answer("Произошла ошибка. Попробуйте еще раз.", show_alert=True)
-    finally:
-        # Сбрасываем флаг обработки в любом случае
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
 
 async def handle_defender_block(callback: types.CallbackQuery, match_state, state: FSMContext):
     try:
-        # Проверяем наличие необходимых полей статистики
-        if 'stats' not in match_state:
-            match_state['stats'] = {
-                "goals": 0,
-                "assists": 0,
-                "saves": 0,
-                "tackles": 0,
-                "fouls": 0,
-                "passes": 0,
-                "interceptions": 0,
-                "clearances": 0,
-                "throws": 0
-            }
+        stats = match_state['stats']
             
-        await send_photo_with_text(
+        await paced_send(
             callback.message,
             'defense',
             'block.jpg',
-            f"🚫 {match_state['current_team']} в защите\n- Защитник ставит блок"
+            match_state['captions']['def_block'],
+            3
         )
-        await asyncio.sleep(3)
         
         if random.random() < 0.5:
-            match_state['stats']['tackles'] = match_state['stats'].get('tackles', 0) + 1
-            await send_photo_with_text(
-                callback.message,
-                'defense',
-                'block_success.jpg',
-                "✅ Отличный блок!\n- Защитник успешно заблокировал удар\n\nВыберите следующее действие:"
-            )
+            stats['tackles'] += 1
             # Сохраняем состояние успешного блока
             match_state['defense_success'] = True
-            await state.update_data(match_state=match_state)
             
-            # Показываем клавиатуру с вариантами действий после блока
-            message = await callback.message.answer(
-                "Что будете делать с мячом?",
+            # Фото блока сразу несет клавиатуру с вариантами действий после блока
+            message = await send_photo_with_text(
+                callback.message,
+                'defense',
+                'block_success.jpg',
+                "✅ Отличный блок!\n- Защитник успешно заблокировал удар\n\nЧто будете делать с мячом?",
                 reply_markup=get_defender_after_defense_keyboard()
             )
             # Сохраняем ID сообщения с кнопками
-            match_state['last_message_id'] = message.message_id
-            await state.update_data(match_state=match_state)
+            if message:
+                match_state['last_message_id'] = message.message_id
         else:                
             await send_photo_with_text(
                 callback.message,
@@ -1436,41 +1786,27 @@ async def handle_defender_block(callback: types.CallbackQuery, match_state, stat
             await continue_match(callback, match_state, state)
     except Exception as e:
         print(f"Error in handle_defender_block: {e}")
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
         await callback.answer("Произошла ошибка. Попробуйте еще раз.", show_alert=True)
     finally:
-        # Сбрасываем флаг обработки в любом случае
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
+        # Сохраняем состояние матча в любом случае
+        _commit_later(state, match_state)
 
-async def handle_defender_pass_left(callback: types.CallbackQuery, match_state, state: FSMContext):
+async def _handle_defender_pass(callback: types.CallbackQuery, match_state, state: FSMContext, *, caption_key):
+    """Пас защитника в сторону, описанную подписью caption_key"""
     try:
-        # Проверяем наличие необходимых полей статистики
-        if 'stats' not in match_state:
-            match_state['stats'] = {
-                "goals": 0,
-                "assists": 0,
-                "saves": 0,
-                "tackles": 0,
-                "fouls": 0,
-                "passes": 0,
-                "interceptions": 0,
-                "clearances": 0,
-                "throws": 0
-            }
+        stats = match_state['stats']
             
-        await send_photo_with_text(
+        await paced_send(
             callback.message,
             'pass',
             'prepare.jpg',
-            f"⬅️ {match_state['current_team']} с мячом\n- Защитник отдает пас влево"
+            match_state['captions'][caption_key],
+            3
         )
-        await asyncio.sleep(3)
         
         if random.random() < 0.7:
             # Увеличиваем счетчик пасов, а не голевых передач
-            match_state['stats']['passes'] = match_state['stats'].get('passes', 0) + 1
+            stats['passes'] += 1
             await send_photo_with_text(
                 callback.message,
                 'pass',
@@ -1478,15 +1814,7 @@ async def handle_defender_pass_left(callback: types.CallbackQuery, match_state,
                 "✅ Отличный пас!\n- Партнер получил мяч в выгодной позиции"
             )
             if random.random() < 0.3:
-                match_state['your_goals'] += 1
-                match_state['stats']['assists'] = match_state['stats'].get('assists', 0) + 1
-                await send_photo_with_text(
-                    callback.message,
-                    'goals',
-                    'goal.jpg',
-                    f"⚽ ГООООЛ!\n- Партнер реализовал момент после вашей передачи! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
-                )
-            await state.update_data(match_state=match_state)
+                await score_goal(callback.message, match_state, "Партнер реализовал момент после вашей передачи!", stat_key='assists')
         else:
             await send_photo_with_text(
                 callback.message,
@@ -1495,108 +1823,34 @@ async def handle_defender_pass_left(callback: types.CallbackQuery, match_state,
                 "❌ Пас перехвачен\n- Соперник перехватил передачу"
             )
             await simulate_opponent_attack(callback, match_state)
-            await state.update_data(match_state=match_state)
-        await state.update_data(match_state=match_state)
         await continue_match(callback, match_state, state)
     finally:
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
+        _commit_later(state, match_state)
+
+async def handle_defender_pass_left(callback: types.CallbackQuery, match_state, state: FSMContext):
+    await _handle_defender_pass(callback, match_state, state, caption_key='def_pass_left')
 
 async def handle_defender_pass_right(callback: types.CallbackQuery, match_state, state: FSMContext):
+    await _handle_defender_pass(callback, match_state, state, caption_key='def_pass_right')
+
+async def handle_defender_clearance(callback: types.CallbackQuery, match_state, state: FSMContext):
     try:
-        # Проверяем наличие необходимых полей статистики
-        if 'stats' not in match_state:
-            match_state['stats'] = {
-                "goals": 0,
-                "assists": 0,
-                "saves": 0,
-                "tackles": 0,
-                "fouls": 0,
-                "passes": 0,
-                "interceptions": 0,
-                "clearances": 0,
-                "throws": 0
-            }
+        stats = match_state['stats']
             
-        await send_photo_with_text(
-            callback.message,
-            'pass',
-            'prepare.jpg',
-            f"➡️ {match_state['current_team']} с мячом\n- Защитник отдает пас вправо"
-        )
-        await asyncio.sleep(3)
-        
-        if random.random() < 0.7:
-            # Увеличиваем счетчик пасов, а не голевых передач
-            match_state['stats']['passes'] = match_state['stats'].get('passes', 0) + 1
-            await send_photo_with_text(
-                callback.message,
-                'pass',
-                'success.jpg',
-                "✅ Отличный пас!\n- Партнер получил мяч в выгодной позиции"
-            )
-            if random.random() < 0.3:
-                match_state['your_goals'] += 1
-                match_state['stats']['assists'] = match_state['stats'].get('assists', 0) + 1
-                await send_photo_with_text(
-                    callback.message,
-                    'goals',
-                    'goal.jpg',
-                    f"⚽ ГООООЛ!\n- Партнер реализовал момент после вашей передачи! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
-                )
-            await state.update_data(match_state=match_state)
-        else:
-            await send_photo_with_text(
-                callback.message,
-                'pass',
-                'intercept.jpg',
-                "❌ Пас перехвачен\n- Соперник перехватил передачу"
-            )
-            await simulate_opponent_attack(callback, match_state)
-            await state.update_data(match_state=match_state)
-        await state.update_data(match_state=match_state)
-        await continue_match(callback, match_state, state)
-    finally:
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
-
-async def handle_defender_clearance(callback: types.CallbackQuery, match_state, state: FSMContext):
-    try:
-        # Проверяем наличие необходимых полей статистики
-        if 'stats' not in match_state:
-            match_state['stats'] = {
-                "goals": 0,
-                "assists": 0,
-                "saves": 0,
-                "tackles": 0,
-                "fouls": 0,
-                "passes": 0,
-                "interceptions": 0,
-                "clearances": 0,
-                "throws": 0
-            }
-            
-        await send_photo_with_text(
+        await paced_send(
             callback.message,
             'defense',
             'intercept.jpg',
-            f"⚽ {match_state['current_team']} в опасности\n- Защитник готовится выбить мяч"
+            match_state['captions']['def_clear'],
+            3
         )
-        await asyncio.sleep(3)
         
         if random.random() < 0.7:
             # Добавляем шанс случайного гола при выбивании мяча
             if random.random() < 0.05:  # 5% шанс случайного гола
-                match_state['your_goals'] += 1
-                match_state['stats']['goals'] = match_state['stats'].get('goals', 0) + 1
-                await send_photo_with_text(
-                    callback.message,
-                    'goals',
-                    'goal.jpg',
-                    f"⚽ ГООООЛ!\n- Невероятно! Защитник случайно забил гол! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
-                )
+                await score_goal(callback.message, match_state, "Невероятно! Защитник случайно забил гол!", stat_key='goals')
             else:
-                match_state['stats']['clearances'] = match_state['stats'].get('clearances', 0) + 1
+                stats['clearances'] += 1
                 await send_photo_with_text(
                     callback.message,
                     'defense',
@@ -1614,53 +1868,37 @@ async def handle_defender_clearance(callback: types.CallbackQuery, match_state,
         
         await continue_match(callback, match_state, state)
     finally:
-        # Сбрасываем флаг обработки в любом случае
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
+        # Сохраняем состояние матча в любом случае
+        _commit_later(state, match_state)
+
+# Клавиатура выбора действия после успешного дриблинга
+_AFTER_DRIBBLE_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="⚽ Удар по воротам", callback_data="action_shot_after_dribble")],
+    [InlineKeyboardButton(text="🎯 Отдать пас", callback_data="action_pass_after_dribble")]
+])
 
 async def handle_forward_shot(callback: types.CallbackQuery, match_state, state: FSMContext):
     try:
-        # Проверяем наличие необходимых полей статистики
-        if 'stats' not in match_state:
-            match_state['stats'] = {
-                "goals": 0,
-                "assists": 0,
-                "saves": 0,
-                "tackles": 0,
-                "fouls": 0,
-                "passes": 0,
-                "interceptions": 0,
-                "clearances": 0,
-                "throws": 0
-            }
-            
-        await send_photo_with_text(
+        await paced_send(
             callback.message,
             'shot',
             'prepare.jpg',
-            f"⚽ {match_state['current_team']} с мячом\n- Нападающий готовится к удару"
+            match_state['captions']['fw_shot'],
+            2
         )
-        await safe_sleep(2)
         
         if random.random() < 0.7:  # 70% шанс на удар в створ
-            await send_photo_with_text(
+            await paced_send(
                 callback.message,
                 'shot',
                 'save.jpg',
-                "🎯 Удар в створ!\n- Вратарь должен реагировать"
+                "🎯 Удар в створ!\n- Вратарь должен реагировать",
+                2
             )
-            await safe_sleep(2)
             
             # 15% шанс гола
             if random.random() < 0.15:
-                match_state['your_goals'] += 1
-                match_state['stats']['goals'] = match_state['stats'].get('goals', 0) + 1
-                await send_photo_with_text(
-                    callback.message,
-                    'goals',
-                    'goal.jpg',
-                    f"⚽ ГООООЛ!\n- Отличный удар! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
-                )
+                await score_goal(callback.message, match_state, "Отличный удар!", stat_key='goals')
             else:
                 await send_photo_with_text(
                     callback.message,
@@ -1678,8 +1916,6 @@ async def handle_forward_shot(callback: types.CallbackQuery, match_state, state:
         
         await safe_sleep(1)
         await simulate_opponent_attack(callback, match_state)
-        # Сохраняем состояние перед продолжением
-        await state.update_data(match_state=match_state)
         await continue_match(callback, match_state, state)
     except Exception as e:
         logger.error(f"Ошибка в handle_forward_shot: {e}")
@@ -1689,56 +1925,36 @@ async def handle_forward_shot(callback: types.CallbackQuery, match_state, state:
         except Exception as continue_error:
             logger.error(f"Не удалось продолжить матч после ошибки: {continue_error}")
     finally:
-        # Сбрасываем флаг обработки в любом случае
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
+        # Сохраняем состояние матча в любом случае
+        _commit_later(state, match_state)
 
 async def handle_forward_pass(callback: types.CallbackQuery, match_state, state: FSMContext):
     try:
-        # Проверяем наличие необходимых полей статистики
-        if 'stats' not in match_state:
-            match_state['stats'] = {
-                "goals": 0,
-                "assists": 0,
-                "saves": 0,
-                "tackles": 0,
-                "fouls": 0,
-                "passes": 0,
-                "interceptions": 0,
-                "clearances": 0,
-                "throws": 0
-            }
+        stats = match_state['stats']
             
-        await send_photo_with_text(
+        await paced_send(
             callback.message,
             'pass',
             'prepare.jpg',
-            f"🎯 {match_state['current_team']} с мячом\n- Нападающий ищет партнера для передачи"
+            match_state['captions']['fw_pass'],
+            2
         )
-        await safe_sleep(2)
         
         if random.random() < 0.7:
             # Увеличиваем счетчик пасов
-            match_state['stats']['passes'] = match_state['stats'].get('passes', 0) + 1
-            await send_photo_with_text(
+            stats['passes'] += 1
+            # Симулируем дальнейшую атаку команды
+            await paced_send(
                 callback.message,
                 'pass',
                 'success.jpg',
-                "✅ Отличный пас!\n- Партнер получил мяч в выгодной позиции"
+                "✅ Отличный пас!\n- Партнер получил мяч в выгодной позиции",
+                2
             )
-            # Симулируем дальнейшую атаку команды
-            await safe_sleep(2)
             # 20% шанс гола после паса
             if random.random() < 0.2:
                 # Увеличиваем счет команды и засчитываем голевую передачу
-                match_state['your_goals'] += 1
-                match_state['stats']['assists'] = match_state['stats'].get('assists', 0) + 1
-                await send_photo_with_text(
-                    callback.message,
-                    'goals',
-                    'goal.jpg',
-                    f"⚽ ГООООЛ!\n- Партнер реализовал момент после вашей передачи! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
-                )
+                await score_goal(callback.message, match_state, "Партнер реализовал момент после вашей передачи!", stat_key='assists')
             else:
                 await send_photo_with_text(
                     callback.message,
@@ -1746,21 +1962,17 @@ async def handle_forward_pass(callback: types.CallbackQuery, match_state, state:
                     'shot_miss.jpg',
                     "❌ Удар неточный\n- Партнер не смог реализовать момент"
                 )
-            # Сохраняем состояние перед продолжением
-            await state.update_data(match_state=match_state)
             # Продолжаем матч
             await continue_match(callback, match_state, state)
         else:
-            await send_photo_with_text(
+            await paced_send(
                 callback.message,
                 'pass',
                 'intercept.jpg',
-                "❌ Пас перехвачен\n- Соперник перехватил передачу"
+                "❌ Пас перехвачен\n- Соперник перехватил передачу",
+                1
             )
-            await safe_sleep(1)
             await simulate_opponent_attack(callback, match_state)
-            # Сохраняем состояние перед продолжением
-            await state.update_data(match_state=match_state)
             await continue_match(callback, match_state, state)
     except Exception as e:
         logger.error(f"Ошибка в handle_forward_pass: {e}")
@@ -1770,65 +1982,41 @@ async def handle_forward_pass(callback: types.CallbackQuery, match_state, state:
         except Exception as continue_error:
             logger.error(f"Не удалось продолжить матч после ошибки: {continue_error}")
     finally:
-        # Сбрасываем флаг обработки в любом случае
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
+        # Сохраняем состояние матча в любом случае
+        _commit_later(state, match_state)
 
 async def handle_forward_dribble(callback: types.CallbackQuery, match_state, state: FSMContext):
     try:
-        # Проверяем наличие необходимых полей статистики
-        if 'stats' not in match_state:
-            match_state['stats'] = {
-                "goals": 0,
-                "assists": 0,
-                "saves": 0,
-                "tackles": 0,
-                "fouls": 0,
-                "passes": 0,
-                "interceptions": 0,
-                "clearances": 0,
-                "throws": 0
-            }
-            
-        await send_photo_with_text(
+        await paced_send(
             callback.message,
             'dribble',
             'start.jpg',
-            f"⚽ {match_state['current_team']} с мячом\n- Нападающий начинает дриблинг"
+            match_state['captions']['fw_dribble'],
+            2
         )
-        await safe_sleep(2)
         
         if random.random() < 0.6:  # 60% шанс успешного дриблинга
-            await send_photo_with_text(
+            # Фото дриблинга сразу несет клавиатуру с выбором действия после дриблинга
+            message = await send_photo_with_text(
                 callback.message,
                 'dribble',
                 'success.jpg',
-                "✅ Отличный дриблинг!\n- Нападающий обыграл защитника"
-            )
-            await safe_sleep(2)
-            
-            # Показываем клавиатуру с выбором действия после дриблинга
-            message = await callback.message.answer(
-                "Выберите следующее действие:",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="⚽ Удар по воротам", callback_data="action_shot_after_dribble")],
-                    [InlineKeyboardButton(text="🎯 Отдать пас", callback_data="action_pass_after_dribble")]
-                ])
+                "✅ Отличный дриблинг!\n- Нападающий обыграл защитника\n\nВыберите следующее действие:",
+                reply_markup=_AFTER_DRIBBLE_KB
             )
             # Сохраняем ID сообщения с кнопками
-            match_state['last_message_id'] = message.message_id
-            await state.update_data(match_state=match_state)
+            if message:
+                match_state['last_message_id'] = message.message_id
             return
         else:
-            await send_photo_with_text(
+            await paced_send(
                 callback.message,
                 'defense',
                 'tackle.jpg',
-                "❌ Дриблинг прерван\n- Защитник отобрал мяч"
+                "❌ Дриблинг прерван\n- Защитник отобрал мяч",
+                1
             )
-            await safe_sleep(1)
             await simulate_opponent_attack(callback, match_state)
-            await state.update_data(match_state=match_state)
             await continue_match(callback, match_state, state)
     except Exception as e:
         logger.error(f"Ошибка в handle_forward_dribble: {e}")
@@ -1837,169 +2025,174 @@ async def handle_forward_dribble(callback: types.CallbackQuery, match_state, sta
         except Exception as continue_error:
             logger.error(f"Не удалось продолжить матч после ошибки: {continue_error}")
     finally:
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
+        _commit_later(state, match_state)
 
 # Добавляем обработчики для действий после дриблинга
-@dp.callback_query(lambda c: c.data == "action_shot_after_dribble")
-async def handle_shot_after_dribble(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    match_state = data.get('match_state', {})
-    
-    await send_photo_with_text(
-        callback.message,
-        'shot',
-        'prepare.jpg',
-        f"⚽ {match_state['current_team']} с мячом\n- Нападающий готовится к удару"
-    )
-    await safe_sleep(2)
-    
-    if random.random() < 0.7:  # 70% шанс на удар в створ
-        await send_photo_with_text(
+@dp.callback_query(F.data == "action_shot_after_dribble")
+async def handle_shot_after_dribble(callback: types.CallbackQuery, match_state, state: FSMContext):
+    if not match_state or match_state.get('match_finished', False) or match_state.get('minute', 0) >= 90:
+        await callback.answer("Матч завершён. Нажмите 'Играть матч' для нового матча.", show_alert=True)
+        return
+    lock = _user_lock(callback.from_user.id)
+    if lock.locked():
+        await callback.answer("Дождитесь завершения текущего момента", show_alert=True)
+        return
+    async with lock:
+        _fire(callback.answer())
+        await paced_send(
             callback.message,
             'shot',
-            'save.jpg',
-            "🎯 Удар в створ!\n- Вратарь должен реагировать"
+            'prepare.jpg',
+            match_state['captions']['fw_shot'],
+            2
         )
-        await safe_sleep(2)
-        
-        # 25% шанс гола после дриблинга
-        if random.random() < 0.25:
-            match_state['your_goals'] += 1
-            match_state['stats']['goals'] = match_state['stats'].get('goals', 0) + 1
-            await send_photo_with_text(
+    
+        if random.random() < 0.7:  # 70% шанс на удар в створ
+            await paced_send(
                 callback.message,
-                'goals',
-                'goal.jpg',
-                f"⚽ ГООООЛ!\n- Отличный дриблинг и удар! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
+                'shot',
+                'save.jpg',
+                "🎯 Удар в створ!\n- Вратарь должен реагировать",
+                2
             )
+        
+            # 25% шанс гола после дриблинга
+            if random.random() < 0.25:
+                await score_goal(callback.message, match_state, "Отличный дриблинг и удар!", stat_key='goals')
+            else:
+                await send_photo_with_text(
+                    callback.message,
+                    'defense',
+                    'save.jpg',
+                    "🖐️ Вратарь парировал удар!\n- Мяч в игре"
+                )
         else:
             await send_photo_with_text(
                 callback.message,
-                'defense',
-                'save.jpg',
-                "🖐️ Вратарь парировал удар!\n- Мяч в игре"
+                'shot',
+                'miss.jpg',
+                "❌ Удар мимо ворот\n- Мяч ушел в аут"
             )
-    else:
-        await send_photo_with_text(
-            callback.message,
-            'shot',
-            'miss.jpg',
-            "❌ Удар мимо ворот\n- Мяч ушел в аут"
-        )
     
-    await safe_sleep(1)
-    await simulate_opponent_attack(callback, match_state)
-    await state.update_data(match_state=match_state)
-    await continue_match(callback, match_state, state)
+        await safe_sleep(1)
+        await simulate_opponent_attack(callback, match_state)
+        await continue_match(callback, match_state, state)
 
-@dp.callback_query(lambda c: c.data == "action_pass_after_dribble")
-async def handle_pass_after_dribble(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    match_state = data.get('match_state', {})
-    
-    await send_photo_with_text(
-        callback.message,
-        'pass',
-        'prepare.jpg',
-        f"🎯 {match_state['current_team']} с мячом\n- Нападающий ищет партнера для передачи"
-    )
-    await safe_sleep(2)
+@dp.callback_query(F.data == "action_pass_after_dribble")
+async def handle_pass_after_dribble(callback: types.CallbackQuery, match_state, state: FSMContext):
+    if not match_state or match_state.get('match_finished', False) or match_state.get('minute', 0) >= 90:
+        await callback.answer("Матч завершён. Нажмите 'Играть матч' для нового матча.", show_alert=True)
+        return
+    lock = _user_lock(callback.from_user.id)
+    if lock.locked():
+        await callback.answer("Дождитесь завершения текущего момента", show_alert=True)
+        return
+    async with lock:
+        _fire(callback.answer())
+        stats = match_state['stats']
     
-    if random.random() < 0.7:
-        match_state['stats']['passes'] = match_state['stats'].get('passes', 0) + 1
-        await send_photo_with_text(
+        await paced_send(
             callback.message,
             'pass',
-            'success.jpg',
-            "✅ Отличный пас!\n- Партнер получил мяч в выгодной позиции"
+            'prepare.jpg',
+            match_state['captions']['fw_pass'],
+            2
         )
-        await safe_sleep(2)
-        
-        # 30% шанс гола после паса после дриблинга
-        if random.random() < 0.3:
-            match_state['your_goals'] += 1
-            match_state['stats']['assists'] = match_state['stats'].get('assists', 0) + 1
-            await send_photo_with_text(
+    
+        if random.random() < 0.7:
+            stats['passes'] += 1
+            await paced_send(
                 callback.message,
-                'goals',
-                'goal.jpg',
-                f"⚽ ГООООЛ!\n- Партнер реализовал момент после вашего дриблинга! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
+                'pass',
+                'success.jpg',
+                "✅ Отличный пас!\n- Партнер получил мяч в выгодной позиции",
+                2
             )
+        
+            # 30% шанс гола после паса после дриблинга
+            if random.random() < 0.3:
+                await score_goal(callback.message, match_state, "Партнер реализовал момент после вашего дриблинга!", stat_key='assists')
+            else:
+                await send_photo_with_text(
+                    callback.message,
+                    'attack',
+                    'shot_miss.jpg',
+                    "❌ Удар неточный\n- Партнер не смог реализовать момент"
+                )
         else:
-            await send_photo_with_text(
+            await paced_send(
                 callback.message,
-                'attack',
-                'shot_miss.jpg',
-                "❌ Удар неточный\n- Партнер не смог реализовать момент"
+                'pass',
+                'intercept.jpg',
+                "❌ Пас перехвачен\n- Соперник перехватил передачу",
+                1
             )
-    else:
-        await send_photo_with_text(
-            callback.message,
-            'pass',
-            'intercept.jpg',
-            "❌ Пас перехвачен\n- Соперник перехватил передачу"
-        )
-        await safe_sleep(1)
-        await simulate_opponent_attack(callback, match_state)
+            await simulate_opponent_attack(callback, match_state)
     
-    await state.update_data(match_state=match_state)
-    await continue_match(callback, match_state, state)
+        await continue_match(callback, match_state, state)
+
+# random.random, связанный один раз на модуль
+_rand = random.random
+
+def _rand_minute_step(_r=_rand):
+    """Случайный шаг игрового времени от 8 до 12 минут (как randint(8, 12))"""
+    return 8 + int(_r() * 5)
 
 async def continue_match(callback: types.CallbackQuery, match_state, state: FSMContext):
     try:
         # Получаем текущее время из состояния
-        current_minute = match_state.get('minute', 0)
-        logger.info(f"Текущее время матча: {current_minute}'")
+        current_minute = match_state['minute']
+        logger.info("Текущее время матча: %d'", current_minute)
         
         # Увеличиваем минуту
         old_minute = current_minute
-        new_minute = current_minute + random.randint(8, 12)
+        new_minute = current_minute + _rand_minute_step()
         
         # Проверяем, не превысили ли 90 минут
         if new_minute >= 90:
             new_minute = 90
-            logger.info(f"Матч завершен: {old_minute}' -> 90'")
+            logger.info("Матч завершен: %d' -> 90'", old_minute)
             match_state['minute'] = new_minute
-            await state.update_data(match_state=match_state)
+            # finish_match читает итог из FSM, поэтому сохраняем его до пометки о завершении;
+            # после нее _commit/_commit_later больше не пишут состояние этого матча
+            await _commit(state, match_state)
+            match_state['match_finished'] = True
             await finish_match(callback, state)
             return
             
         # Обновляем время в состоянии
         match_state['minute'] = new_minute
-        await state.update_data(match_state=match_state)
         
-        logger.info(f"Продолжение матча: {old_minute}' -> {new_minute}'")
-        logger.info(f"Время сохранено в состоянии: {match_state['minute']}'")
+        logger.info("Продолжение матча: %d' -> %d'", old_minute, new_minute)
         
-        your_goals = match_state.get('your_goals', 0)
-        opponent_goals = match_state.get('opponent_goals', 0)
+        your_goals = match_state['your_goals']
+        opponent_goals = match_state['opponent_goals']
         
         # Определяем, будет ли следующий момент атакой соперника для вратаря и защитника
         position = match_state['position']
         
         # Случайно выбираем, чья будет атака (40% шанс атаки своей команды)
-        is_team_attack = random.random() < 0.4
-        logger.debug(f"Тип атаки: {'команда' if is_team_attack else 'соперник'}")
+        is_team_attack = _rand() < 0.4
+        logger.debug("Тип атаки: %s", 'команда' if is_team_attack else 'соперник')
         
-        if position in ["Вратарь", "Защитник"]:
+        if get_position_profile(position)['defensive']:
             if is_team_attack:
                 # Симулируем атаку своей команды
-                logger.info(f"Атака команды {match_state['current_team']}")
+                logger.info("Атака команды %s", match_state['current_team'])
                 await simulate_team_attack(callback, match_state)
                 message = (
                     f"⏱️ {new_minute}' минута\n"
                     f"Счёт: {your_goals} - {opponent_goals}\n"
-                    f"⚠️ {match_state['opponent_team']} начинает атаку!\n\n"
+                    f"{match_state['captions']['opponent_attack']}\n\n"
                     "Выберите действие:"
                 )
             else:
                 match_state['is_opponent_attack'] = True
-                logger.info(f"Атака соперника {match_state['opponent_team']}")
+                logger.info("Атака соперника %s", match_state['opponent_team'])
                 message = (
                     f"⏱️ {new_minute}' минута\n"
                     f"Счёт: {your_goals} - {opponent_goals}\n"
-                    f"⚠️ {match_state['opponent_team']} начинает атаку!\n\n"
+                    f"{match_state['captions']['opponent_attack']}\n\n"
                     "Выберите действие:"
                 )
         else:
@@ -2022,225 +2215,166 @@ async def continue_match(callback: types.CallbackQuery, match_state, state: FSMC
         
         # Обновляем ID последнего сообщения
         match_state['last_message_id'] = new_message.message_id
-        await state.update_data(match_state=match_state)
         
     except Exception as e:
-        logger.error(f"Ошибка в continue_match: {e}")
+        logger.error("Ошибка в continue_match: %s", e)
         await callback.answer("Произошла ошибка. Попробуйте еще раз.", show_alert=True)
     finally:
-        # Сбрасываем флаг обработки в любом случае
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
+        # Сохраняем состояние матча (завершенный матч _commit_later пропускает сам)
+        _commit_later(state, match_state)
+
+# Вероятности типов атак: дриблинг 30%, удар 40%, пас 30%
+_ATTACK_TYPE_WEIGHTS = {'dribble': 0.3, 'shot': 0.4, 'pass': 0.3}
+
+# Сценарии атак: подпись подготовки, шанс гола, описание гола и подпись неудачи.
+# Ключ верхнего уровня - поле счета, которое увеличивается при голе
+_ATTACK_TABLE = {
+    'your_goals': {
+        'shot': {
+            'prepare': ('shot', 'prepare.jpg', "⚽ <b>{team}</b> атакует!\n- Партнер по команде готовится к удару"),
+            'p': 0.3,
+            'goal': "Партнер по команде забивает!",
+            'fail': ('attack', 'shot_miss.jpg', "❌ Мимо ворот\n- Удар партнера оказался неточным"),
+        },
+        'pass': {
+            'prepare': ('pass', 'prepare.jpg', "🎯 <b>{team}</b> в атаке\n- Команда разыгрывает комбинацию"),
+            'p': 0.4,
+            'goal': "Красивая командная комбинация!",
+            'fail': ('attack', 'pass_fail.jpg', "❌ Не получилось\n- Соперник прервал атаку"),
+        },
+        'dribble': {
+            'prepare': ('dribble', 'start.jpg', "🏃 <b>{team}</b> атакует\n- Партнер пытается обыграть защитника"),
+            'p': 0.35,
+            'goal': "Индивидуальное мастерство!",
+            'fail': ('attack', 'dribble_fail.jpg', "❌ Потеря мяча\n- Защитник соперника отобрал мяч"),
+        },
+    },
+    'opponent_goals': {
+        'shot': {
+            'prepare': ('shot', 'prepare.jpg', "⚽ <b>{team}</b> атакует!\n- Соперник готовится к удару"),
+            'p': 0.3,
+            'goal': "Соперник забивает!",
+            'fail': ('attack', 'shot_miss.jpg', "❌ Мимо ворот\n- Удар соперника оказался неточным"),
+        },
+        'pass': {
+            'prepare': ('pass', 'prepare.jpg', "🎯 <b>{team}</b> атакует\n- Соперник ищет партнера для передачи"),
+            # Передача перед ударом: при неудаче атака заканчивается перехватом
+            'relay': {
+                'p': 0.7,
+                'success': ('pass', 'success.jpg', "✅ Соперник отдал точный пас!\n- Мяч у партнера в выгодной позиции"),
+                'fail': ('pass', 'intercept.jpg', "✅ Перехват!\n- Ваша команда перехватила передачу соперника"),
+            },
+            'p': 0.3,
+            'goal': "Соперник забивает после передачи!",
+            'fail': ('attack', 'shot_miss.jpg', "❌ Мимо ворот\n- Партнер соперника не смог реализовать момент"),
+        },
+        'dribble': {
+            'prepare': ('dribble', 'start.jpg', "🏃 <b>{team}</b> атакует\n- Соперник пытается обыграть защитника"),
+            'p': 0.35,
+            'goal': "Соперник забивает после дриблинга!",
+            'fail': ('attack', 'dribble_fail.jpg', "✅ Отбор!\n- Ваш защитник отобрал мяч у соперника"),
+        },
+    },
+}
+
+# Подписи моментов, зависящие только от названий команд
+_MATCH_CAPTION_TEMPLATES = {
+    'gk_save': "🖐️ {team} в опасности!\n- Вратарь готовится к спасению",
+    'gk_kick': "⚽ {team} с мячом\n- Вратарь готовится выбить мяч",
+    'gk_throw': "🎯 {team} с мячом\n- Вратарь готовится к выбросу мяча",
+    'def_tackle': "🛡️ {team} в защите\n- Защитник готовится к отбору мяча",
+    'def_block': "🚫 {team} в защите\n- Защитник ставит блок",
+    'def_pass_left': "⬅️ {team} с мячом\n- Защитник отдает пас влево",
+    'def_pass_right': "➡️ {team} с мячом\n- Защитник отдает пас вправо",
+    'def_clear': "⚽ {team} в опасности\n- Защитник готовится выбить мяч",
+    'fw_shot': "⚽ {team} с мячом\n- Нападающий готовится к удару",
+    'fw_pass': "🎯 {team} с мячом\n- Нападающий ищет партнера для передачи",
+    'fw_dribble': "⚽ {team} с мячом\n- Нападающий начинает дриблинг",
+    'opponent_attack': "⚠️ {opponent} начинает атаку!",
+}
+
+@lru_cache(maxsize=256)
+def _build_captions(team, opponent):
+    """Подставляет названия команд в подписи; результат общий для всех матчей этой пары команд"""
+    captions = {
+        key: template.format(team=team, opponent=opponent)
+        for key, template in _MATCH_CAPTION_TEMPLATES.items()
+    }
+    for goals_field, entries in _ATTACK_TABLE.items():
+        attacker = team if goals_field == 'your_goals' else opponent
+        for attack_type, entry in entries.items():
+            captions[f"attack_{goals_field}_{attack_type}"] = entry['prepare'][2].format(team=attacker)
+    return MappingProxyType(captions)
+
+def _build_attack_outcomes(entries):
+    """Раскладывает сценарии атак на конечные исходы (тип, передача прошла, гол) с накопленными весами"""
+    outcomes = []
+    cum_weights = []
+    total = 0.0
+    for attack_type, entry in entries.items():
+        type_weight = _ATTACK_TYPE_WEIGHTS[attack_type]
+        relay = entry.get('relay')
+        relay_p = relay['p'] if relay else 1.0
+        if relay:
+            # Передача перехвачена - атака заканчивается без удара
+            outcomes.append((attack_type, False, False))
+            total += type_weight * (1 - relay_p)
+            cum_weights.append(total)
+        for scored, goal_p in ((True, entry['p']), (False, 1 - entry['p'])):
+            outcomes.append((attack_type, True, scored))
+            total += type_weight * relay_p * goal_p
+            cum_weights.append(total)
+    return outcomes, cum_weights
+
+# Исходы атак для каждой стороны; разыгрываются одним вызовом random.choices
+_ATTACK_OUTCOMES = {
+    goals_field: _build_attack_outcomes(entries) for goals_field, entries in _ATTACK_TABLE.items()
+}
+
+async def _play_attack(message, match_state, goals_field, lead=()):
+    """Разыгрывает атаку по сценарию из _ATTACK_TABLE; lead - фото, предваряющие атаку"""
+    outcomes, cum_weights = _ATTACK_OUTCOMES[goals_field]
+    attack_type, relayed, scored = random.choices(outcomes, cum_weights=cum_weights)[0]
+    entry = _ATTACK_TABLE[goals_field][attack_type]
+    folder, filename, _ = entry['prepare']
+    caption = match_state['captions'][f"attack_{goals_field}_{attack_type}"]
+
+    # Все фото до развязки уходят одним альбомом, пауза - только перед развязкой
+    narration = [*lead, (folder, filename, caption)]
+    relay = entry.get('relay')
+    if relay and relayed:
+        narration.append(relay['success'])
+    await paced_send_group(message, narration, 2)
+
+    if relay and not relayed:
+        await send_photo_with_text(message, *relay['fail'])
+        return
+
+    if scored:
+        await score_goal(message, match_state, entry['goal'], goals_field=goals_field)
+    else:
+        await send_photo_with_text(message, *entry['fail'])
 
 async def simulate_team_attack(callback: types.CallbackQuery, match_state):
     """Симуляция атаки своей команды"""
-    # Проверяем наличие необходимых полей в match_state
-    if 'stats' not in match_state:
-        match_state['stats'] = {
-            "goals": 0,
-            "assists": 0,
-            "saves": 0,
-            "tackles": 0,
-            "fouls": 0,
-            "passes": 0,
-            "interceptions": 0,
-            "clearances": 0,
-            "throws": 0
-        }
-        
-    attack_type = random.choices(
-        ['dribble', 'shot', 'pass'],
-        weights=[0.3, 0.4, 0.3]
-    )[0]
-    
-    if attack_type == "shot":
-        await send_photo_with_text(
-            callback.message,
-            'shot',
-            'prepare.jpg',
-            f"⚽ <b>{match_state['current_team']}</b> атакует!\n- Партнер по команде готовится к удару"
-        )
-        await asyncio.sleep(2)
-        
-        if random.random() < 0.3:  # 30% шанс гола
-            match_state['your_goals'] += 1
-            await send_photo_with_text(
-                callback.message,
-                'goals',
-                'goal.jpg',
-                f"⚽ ГООООЛ!\n- Партнер по команде забивает! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
-            )
-        else:
-            await send_photo_with_text(
-                callback.message,
-                'attack',
-                'shot_miss.jpg',
-                "❌ Мимо ворот\n- Удар партнера оказался неточным"
-            )
-    
-    elif attack_type == "pass":
-        await send_photo_with_text(
-            callback.message,
-            'pass',
-            'prepare.jpg',
-            f"🎯 <b>{match_state['current_team']}</b> в атаке\n- Команда разыгрывает комбинацию"
-        )
-        await asyncio.sleep(2)
-        
-        if random.random() < 0.4:  # 40% шанс успешной комбинации
-            match_state['your_goals'] += 1
-            await send_photo_with_text(
-                callback.message,
-                'goals',
-                'goal.jpg',
-                f"⚽ ГООООЛ!\n- Красивая командная комбинация! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
-            )
-        else:
-            await send_photo_with_text(
-                callback.message,
-                'attack',
-                'pass_fail.jpg',
-                "❌ Не получилось\n- Соперник прервал атаку"
-            )
-    
-    else:  # dribble
-        await send_photo_with_text(
-            callback.message,
-            'dribble',
-            'start.jpg',
-            f"🏃 <b>{match_state['current_team']}</b> атакует\n- Партнер пытается обыграть защитника"
-        )
-        await asyncio.sleep(2)
-        
-        if random.random() < 0.35:  # 35% шанс успешной атаки
-            match_state['your_goals'] += 1
-            await send_photo_with_text(
-                callback.message,
-                'goals',
-                'goal.jpg',
-                f"⚽ ГООООЛ!\n- Индивидуальное мастерство! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
-            )
-        else:
-            await send_photo_with_text(
-                callback.message,
-                'attack',
-                'dribble_fail.jpg',
-                "❌ Потеря мяча\n- Защитник соперника отобрал мяч"
-            )
+    await _play_attack(callback.message, match_state, 'your_goals')
+
+# Фото начала контратаки соперника
+_COUNTER_ATTACK_PHOTO = ('attack', 'counter.jpg', "⚡ ВНЕЗАПНАЯ КОНТРАТАКА!\n- Соперник быстро переходит в атаку")
 
 async def simulate_opponent_attack(callback: types.CallbackQuery, match_state):
     """Симуляция атаки соперника"""
     # 40% шанс на контратаку
     if random.random() > 0.4:
-        await send_photo_with_text(
-            callback.message,
-            'attack',
-            'counter.jpg',
-            "⚡ ВНЕЗАПНАЯ КОНТРАТАКА!\n- Соперник быстро переходит в атаку"
-        )
-        await safe_sleep(2)
-        
-        attack_type = random.choices(
-            ['dribble', 'shot', 'pass'],
-            weights=[0.3, 0.4, 0.3]
-        )[0]
-        
-        if attack_type == "shot":
-            await send_photo_with_text(
-                callback.message,
-                'shot',
-                'prepare.jpg',
-                f"⚽ <b>{match_state['opponent_team']}</b> атакует!\n- Соперник готовится к удару"
-            )
-            await safe_sleep(2)
-            
-            if random.random() < 0.3:  # 30% шанс гола
-                match_state['opponent_goals'] += 1
-                await send_photo_with_text(
-                    callback.message,
-                    'goals',
-                    'goal.jpg',
-                    f"⚽ ГООООЛ!\n- Соперник забивает! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
-                )
-            else:
-                await send_photo_with_text(
-                    callback.message,
-                    'attack',
-                    'shot_miss.jpg',
-                    "❌ Мимо ворот\n- Удар соперника оказался неточным"
-                )
-        elif attack_type == "pass":
-            await send_photo_with_text(
-                callback.message,
-                'pass',
-                'prepare.jpg',
-                f"🎯 <b>{match_state['opponent_team']}</b> атакует\n- Соперник ищет партнера для передачи"
-            )
-            await safe_sleep(2)
-            
-            if random.random() < 0.7:
-                await send_photo_with_text(
-                    callback.message,
-                    'pass',
-                    'success.jpg',
-                    "✅ Соперник отдал точный пас!\n- Мяч у партнера в выгодной позиции"
-                )
-                await safe_sleep(2)
-                
-                if random.random() < 0.3:  # 30% шанс гола после паса
-                    match_state['opponent_goals'] += 1
-                    await send_photo_with_text(
-                        callback.message,
-                        'goals',
-                        'goal.jpg',
-                        f"⚽ ГООООЛ!\n- Соперник забивает после передачи! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
-                    )
-                else:
-                    await send_photo_with_text(
-                        callback.message,
-                        'attack',
-                        'shot_miss.jpg',
-                        "❌ Мимо ворот\n- Партнер соперника не смог реализовать момент"
-                    )
-            else:
-                await send_photo_with_text(
-                    callback.message,
-                    'pass',
-                    'intercept.jpg',
-                    "✅ Перехват!\n- Ваша команда перехватила передачу соперника"
-                )
-        else:  # dribble
-            await send_photo_with_text(
-                callback.message,
-                'dribble',
-                'start.jpg',
-                f"🏃 <b>{match_state['opponent_team']}</b> атакует\n- Соперник пытается обыграть защитника"
-            )
-            await safe_sleep(2)
-            
-            if random.random() < 0.35:  # 35% шанс успешной атаки
-                match_state['opponent_goals'] += 1
-                await send_photo_with_text(
-                    callback.message,
-                    'goals',
-                    'goal.jpg',
-                    f"⚽ ГООООЛ!\n- Соперник забивает после дриблинга! Счёт: {match_state['your_goals']}-{match_state['opponent_goals']}"
-                )
-            else:
-                await send_photo_with_text(
-                    callback.message,
-                    'attack',
-                    'dribble_fail.jpg',
-                    "✅ Отбор!\n- Ваш защитник отобрал мяч у соперника"
-                )
+        await _play_attack(callback.message, match_state, 'opponent_goals', lead=(_COUNTER_ATTACK_PHOTO,))
     else:
-        await send_photo_with_text(
+        await paced_send(
             callback.message,
             'attack',
             'possession.jpg',
-            "🔄 Мяч в игре\n- Команды борются за контроль мяча"
+            "🔄 Мяч в игре\n- Команды борются за контроль мяча",
+            2
         )
-        await safe_sleep(2)
 
 # Функция завершения матча
 async def finish_match(callback: types.CallbackQuery, state: FSMContext):
@@ -2263,27 +2397,31 @@ async def finish_match(callback: types.CallbackQuery, state: FSMContext):
             result = 'loss'
         else:
             result = 'draw'
-        # --- Обновляем статистику ---
+        # --- Статистика после матча: сохраняется одним UPDATE и выводится в итоговом сообщении ---
+        stats = match_state.get('stats', {})
+        new_stats = {
+            'matches': player.matches + 1,
+            'wins': player.wins + (result == 'win'),
+            'draws': player.draws + (result == 'draw'),
+            'losses': player.losses + (result == 'loss'),
+            'current_round': player.current_round + 1,
+        }
+        # Неизменившиеся игровые показатели в UPDATE не включаем
+        for key in ('goals', 'assists', 'saves', 'tackles'):
+            delta = stats.get(key, 0)
+            if delta:
+                new_stats[key] = getattr(player, key) + delta
         if result == 'win':
-            await update_player_stats(player.user_id, wins=player.wins + 1)
-            logger.info(f"Игрок {player.name} выиграл матч против {match_state.get('opponent_team')}")
+            logger.info("Игрок %s выиграл матч против %s", player.name, match_state.get('opponent_team'))
         elif result == 'loss':
-            await update_player_stats(player.user_id, losses=player.losses + 1)
-            logger.info(f"Игрок {player.name} проиграл матч против {match_state.get('opponent_team')}")
+            logger.info("Игрок %s проиграл матч против %s", player.name, match_state.get('opponent_team'))
         else:
-            await update_player_stats(player.user_id, draws=player.draws + 1)
-            logger.info(f"Игрок {player.name} сыграл вничью с {match_state.get('opponent_team')}")
-        # Обновляем общее количество матчей и текущий тур
-        await update_player_stats(
-            player.user_id, 
-            matches=player.matches + 1,
-            current_round=player.current_round + 1
-        )
-        # Обновляем виртуальную дату
-        new_date = await advance_virtual_date(player)
-        logger.info(f"Обновлена дата для игрока {player.name}: {new_date}")
+            logger.info("Игрок %s сыграл вничью с %s", player.name, match_state.get('opponent_team'))
+        # Новая виртуальная дата сохраняется вместе со статистикой
+        new_date = await advance_virtual_date(player, **new_stats)
+        logger.info("Обновлена дата для игрока %s: %s", player.name, new_date)
         # Очищаем все состояния
-        await state.clear()
+        await clear_match_state(state)
         # Формируем красивый счёт
         score_str = f"{your_goals}-{opponent_goals}"
         # Отправляем сообщение о завершении матча
@@ -2292,49 +2430,38 @@ async def finish_match(callback: types.CallbackQuery, state: FSMContext):
             f"Результат: {result.upper()}\n"
             f"Счет: {score_str}\n\n"
             f"Ваша статистика:\n"
-            f"Матчи: {player.matches + 1}\n"
-            f"Победы: {player.wins + (1 if result == 'win' else 0)}\n"
-            f"Ничьи: {player.draws + (1 if result == 'draw' else 0)}\n"
-            f"Поражения: {player.losses + (1 if result == 'loss' else 0)}\n\n"
+            f"Матчи: {new_stats['matches']}\n"
+            f"Победы: {new_stats['wins']}\n"
+            f"Ничьи: {new_stats['draws']}\n"
+            f"Поражения: {new_stats['losses']}\n\n"
             f"Следующий матч: {new_date}",
             reply_markup=get_main_keyboard()
         )
-        # Сохраняем флаг завершения матча
-        match_state['match_finished'] = True
-        await state.update_data(match_state=match_state)
-        # --- Обновляем индивидуальную статистику ---
-        stats = match_state.get('stats', {})
-        await update_player_stats(
-            player.user_id,
-            goals=player.goals + stats.get('goals', 0),
-            assists=player.assists + stats.get('assists', 0),
-            saves=player.saves + stats.get('saves', 0),
-            tackles=player.tackles + stats.get('tackles', 0)
-        )
     except Exception as e:
-        logger.error(f"Ошибка при завершении матча: {e}")
+        logger.error("Ошибка при завершении матча: %s", e)
         await callback.answer("Произошла ошибка при завершении матча")
         # В случае ошибки тоже очищаем состояние
-        await state.clear()
+        await clear_match_state(state)
 
-@dp.callback_query(lambda c: c.data == "show_stats")
-async def show_stats_callback(callback: types.CallbackQuery, state: FSMContext):
-    # Проверяем, не идет ли сейчас матч
-    current_state = await state.get_state()
-    if current_state == GameStates.playing.state:
-        await callback.answer("Нельзя просматривать статистику во время матча!", show_alert=True)
-        return
-        
-    # Очищаем состояние матча
-    await state.update_data(match_state=None)
-    # Получаем данные игрока
-    player = await get_player(callback.from_user.id)
-    if not player:
-        await callback.message.answer("Вы еще не создали игрока. Используйте /start для начала игры.")
-        return
-    
-    # Формируем сообщение со статистикой
-    stats_message = (
+# Пользователи, для которых выставлялось состояние playing. FSM остается источником истины:
+# при хранении в памяти вне этого множества матч точно не идет, и хранилище можно не читать.
+# Redis переживает перезапуск, а множество - нет, поэтому с ним FSM читается всегда
+_PLAYING_USERS: set[int] = set()
+
+async def is_match_in_progress(user_id, state: FSMContext):
+    """Проверяет, идет ли у пользователя матч, обращаясь к FSM в памяти только для игроков из _PLAYING_USERS"""
+    if user_id not in _PLAYING_USERS and isinstance(dp.fsm.storage, MemoryStorage):
+        return False
+    if await state.get_state() == GameStates.playing.state:
+        return True
+    # Состояние уже очищено другим обработчиком - убираем устаревшую запись
+    _PLAYING_USERS.discard(user_id)
+    return False
+
+# Функция форматирования статистики игрока
+def _format_stats(player):
+    """Возвращает сообщение со статистикой игрока одним f-string выражением"""
+    return (
         f"📊 Статистика игрока {player.name}\n\n"
         f"🏃 Позиция: {player.position}\n"
         f"🏟️ Клуб: {player.club}\n"
@@ -2347,13 +2474,28 @@ async def show_stats_callback(callback: types.CallbackQuery, state: FSMContext):
         f"🖐️ Сейвов: {player.saves}\n"
         f"🛡️ Отборов: {player.tackles}\n"
     )
+
+@dp.callback_query(F.data == "show_stats")
+async def show_stats_callback(callback: types.CallbackQuery, state: FSMContext):
+    # Проверяем, не идет ли сейчас матч
+    if await is_match_in_progress(callback.from_user.id, state):
+        await callback.answer("Нельзя просматривать статистику во время матча!", show_alert=True)
+        return
+        
+    # Очищаем состояние матча
+    await clear_match_state(state, keep_fsm_state=True)
+    # Получаем данные игрока
+    player = await get_player_cached(callback.from_user.id)
+    if not player:
+        await callback.message.answer("Вы еще не создали игрока. Используйте /start для начала игры.")
+        return
     
-    await callback.message.answer(stats_message, reply_markup=get_main_menu_keyboard())
+    await callback.message.answer(_format_stats(player), reply_markup=get_main_menu_keyboard())
 
-@dp.callback_query(lambda c: c.data == "return_to_menu")
+@dp.callback_query(F.data == "return_to_menu")
 async def handle_return_to_menu(callback: types.CallbackQuery, state: FSMContext):
     try:
-        player = await get_player(callback.from_user.id)
+        player = await get_player_cached(callback.from_user.id)
         if player:
             welcome_text = (
                 f"👋 Привет, {player.name}!\n\n"
@@ -2365,13 +2507,7 @@ async def handle_return_to_menu(callback: types.CallbackQuery, state: FSMContext
                 "⭐ Стань легендой футбола!"
             )
             await callback.message.delete()
-            with open("mbappe.png", "rb") as file:
-                photo = BufferedInputFile(file.read(), filename="mbappe.png")
-                await callback.message.answer_photo(
-                    photo,
-                    caption=welcome_text,
-                    reply_markup=get_main_keyboard()
-                )
+            await send_welcome_photo(callback.message, welcome_text, get_main_keyboard())
         else:
             await callback.message.delete()
             await callback.message.answer(
@@ -2387,10 +2523,10 @@ async def handle_return_to_menu(callback: types.CallbackQuery, state: FSMContext
             raise
     await callback.answer()
 
-async def reset_player_stats(user_id):
+async def reset_player_stats(user_id, session=None):
     try:
-        async with async_session() as session:
-            await session.execute(
+        async with _use_session(session) as db:
+            await db.execute(
                 update(Player).where(Player.user_id == user_id).values(
                     matches=0,
                     wins=0,
@@ -2404,32 +2540,37 @@ async def reset_player_stats(user_id):
                     last_match_date=SEASON_START_DATE
                 )
             )
-            await session.commit()
-            logger.info(f"Статистика игрока {user_id} сброшена")
+        _forget_calendar(user_id)
+        _forget_player(user_id)
+        logger.info("Статистика игрока %s сброшена", user_id)
     except Exception as e:
-        logger.error(f"Ошибка при сбросе статистики игрока {user_id}: {e}")
+        logger.error("Ошибка при сбросе статистики игрока %s: %s", user_id, e)
         raise
 
-async def delete_player(user_id):
+async def delete_player(user_id, session=None):
     try:
-        async with async_session() as session:
-            await session.execute(
-                delete(Player).where(Player.user_id == user_id)
-            )
-            await session.commit()
-            logger.info(f"Игрок {user_id} удален из базы данных")
+        async with _use_session(session) as db:
+            await db.execute(delete(Player).where(Player.user_id == user_id))
+        _forget_calendar(user_id)
+        _forget_player(user_id)
+        logger.info("Игрок %s удален из базы данных", user_id)
     except Exception as e:
-        logger.error(f"Ошибка при удалении игрока {user_id}: {e}")
+        logger.error("Ошибка при удалении игрока %s: %s", user_id, e)
         raise
 
+_RESET_STATS_CONFIRM_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="✅ Да, сбросить", callback_data="confirm_reset")],
+    [InlineKeyboardButton(text="❌ Нет, отмена", callback_data="cancel_reset")]
+])
+
 @dp.message(Command("reset_stats"))
 async def cmd_reset_stats(message: types.Message, state: FSMContext):
-    logger.info(f"Пользователь {message.from_user.id} запросил сброс статистики")
+    logger.info("Пользователь %s запросил сброс статистики", message.from_user.id)
     
     # Проверяем, не идет ли сейчас матч
     data = await state.get_data()
     if data.get('match_state'):
-        logger.warning(f"Пользователь {message.from_user.id} попытался сбросить статистику во время матча")
+        logger.warning("Пользователь %s попытался сбросить статистику во время матча", message.from_user.id)
         await message.answer(
             "❌ Сейчас идет матч! Дождитесь его завершения.",
             reply_markup=get_main_keyboard()
@@ -2438,28 +2579,23 @@ async def cmd_reset_stats(message: types.Message, state: FSMContext):
     
     player = await get_player(message.from_user.id)
     if not player:
-        logger.warning(f"Пользователь {message.from_user.id} попытался сбросить статистику без создания игрока")
+        logger.warning("Пользователь %s попытался сбросить статистику без создания игрока", message.from_user.id)
         await message.answer(
             "❌ Вы еще не создали своего игрока. Используйте команду /start",
             reply_markup=get_main_keyboard()
         )
         return
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Да, сбросить", callback_data="confirm_reset")],
-        [InlineKeyboardButton(text="❌ Нет, отмена", callback_data="cancel_reset")]
-    ])
-    
     await message.answer(
         f"⚠️ Вы уверены, что хотите сбросить статистику?\n\n"
         f"Имя: {player.name}\n"
         f"Позиция: {player.position}\n"
         f"Клуб: {player.club}\n\n"
         f"Вся статистика будет обнулена, но имя, позиция и клуб останутся прежними.",
-        reply_markup=keyboard
+        reply_markup=_RESET_STATS_CONFIRM_KB
     )
 
-@dp.callback_query(lambda c: c.data == "confirm_reset")
+@dp.callback_query(F.data == "confirm_reset")
 async def confirm_reset_callback(callback: types.CallbackQuery, state: FSMContext):
     logger.info(f"Пользователь {callback.from_user.id} подтвердил сброс статистики")
     await reset_player_stats(callback.from_user.id)
@@ -2472,7 +2608,7 @@ async def confirm_reset_callback(callback: types.CallbackQuery, state: FSMContex
     except Exception as e:
         logger.debug(f"Не удалось ответить на callback: {e}")
 
-@dp.callback_query(lambda c: c.data == "cancel_reset")
+@dp.callback_query(F.data == "cancel_reset")
 async def cancel_reset_callback(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text(
         "❌ Сброс статистики отменен.\n"
@@ -2484,30 +2620,23 @@ async def cancel_reset_callback(callback: types.CallbackQuery, state: FSMContext
         logger.debug(f"Не удалось ответить на callback: {e}")
 
 # 2. Функция для проверки и генерации предложений о переходе
-TOP_SILVER = ["Текстильщик", "Сибирь", "Авангард-Курск"]
-MID_GOLD = ["Волгарь", "Челябинск", "Родина-2", "Машук-КМВ", "Велес"]
+TOP_SILVER = ("Текстильщик", "Сибирь", "Авангард-Курск")
+MID_GOLD = ("Волгарь", "Челябинск", "Родина-2", "Машук-КМВ", "Велес")
+_TOP_SILVER_SET = frozenset(TOP_SILVER)
 
 def get_transfer_offers(player):
-    # Получаем статистику игрока
-    club = player.club
-    matches = player.matches
+    # Без 10 сыгранных матчей предложений не бывает
+    if player.matches < 10:
+        return None, []
     goals = player.goals
     assists = player.assists
-    saves = player.saves
-    tackles = player.tackles
-    position = player.position
-    offers = []
     # Переход из топ Серебра в середняк Золота
-    if club in TOP_SILVER and matches >= 10 and (goals >= 5 or assists >= 5 or saves >= 40 or tackles >= 25):
-        offers = random.sample(MID_GOLD, 2)
-        return 'gold', offers
-    # Переход внутри Серебра (вверх)
-    elif club not in TOP_SILVER and matches >= 10 and (goals >= 5 or assists >= 5 or saves >= 5 or tackles >= 5):
-        # Предлагаем топ-клубы Серебра, кроме текущего
-        available = [c for c in TOP_SILVER if c != club]
-        if available:
-            offers = random.sample(available, min(2, len(available)))
-            return 'silver', offers
+    if player.club in _TOP_SILVER_SET:
+        if goals >= 5 or assists >= 5 or player.saves >= 40 or player.tackles >= 25:
+            return 'gold', random.sample(MID_GOLD, 2)
+    # Переход внутри Серебра (вверх): клуб игрока не из топа, поэтому доступны все топ-клубы
+    elif goals >= 5 or assists >= 5 or player.saves >= 5 or player.tackles >= 5:
+        return 'silver', random.sample(TOP_SILVER, 2)
     return None, []
 
 # 3. Клавиатура для перехода
@@ -2522,15 +2651,20 @@ def get_transfer_keyboard(offers, league):
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 # 4. Callback для перехода
-@dp.callback_query(lambda c: c.data.startswith('transfer_'))
+@dp.callback_query(F.data.startswith("transfer_"))
 async def transfer_callback(callback: types.CallbackQuery, state: FSMContext):
-    parts = callback.data.split('_')
-    league = parts[1]
-    club = '_'.join(parts[2:])
+    # transfer_<league>_<club>; название клуба может само содержать '_'
+    _, _, rest = callback.data.partition('_')
+    league, _, club = rest.partition('_')
     await update_player_club(callback.from_user.id, club)
     await callback.message.answer(f"Вы успешно перешли в клуб {club} ({'ФНЛ Золото' if league == 'gold' else 'ФНЛ Серебро'})! Поздравляем!", reply_markup=get_main_keyboard())
     await callback.answer()
 
+_DELETE_CONFIRM_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="✅ Да, удалить", callback_data="confirm_delete")],
+    [InlineKeyboardButton(text="❌ Нет, отмена", callback_data="cancel_delete")]
+])
+
 @dp.message(Command("delete_player"))
 async def cmd_delete_player(message: types.Message, state: FSMContext):
     logger.info(f"Пользователь {message.from_user.id} запросил удаление игрока")
@@ -2553,21 +2687,16 @@ async def cmd_delete_player(message: types.Message, state: FSMContext):
         )
         return
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Да, удалить", callback_data="confirm_delete")],
-        [InlineKeyboardButton(text="❌ Нет, отмена", callback_data="cancel_delete")]
-    ])
-    
     await message.answer(
         f"⚠️ Вы уверены, что хотите удалить игрока?\n\n"
         f"Имя: {player.name}\n"
         f"Позиция: {player.position}\n"
         f"Клуб: {player.club}\n\n"
         f"Вся статистика будет удалена без возможности восстановления.",
-        reply_markup=keyboard
+        reply_markup=_DELETE_CONFIRM_KB
     )
 
-@dp.callback_query(lambda c: c.data == "confirm_delete")
+@dp.callback_query(F.data == "confirm_delete")
 async def confirm_delete_callback(callback: types.CallbackQuery, state: FSMContext):
     logger.info(f"Пользователь {callback.from_user.id} подтвердил удаление игрока")
     await delete_player(callback.from_user.id)
@@ -2580,7 +2709,7 @@ async def confirm_delete_callback(callback: types.CallbackQuery, state: FSMConte
     except Exception as e:
         logger.debug(f"Не удалось ответить на callback: {e}")
 
-@dp.callback_query(lambda c: c.data == "cancel_delete")
+@dp.callback_query(F.data == "cancel_delete")
 async def cancel_delete_callback(callback: types.CallbackQuery, state: FSMContext):
     logger.info(f"Пользователь {callback.from_user.id} отменил удаление игрока")
     await callback.message.edit_text(
@@ -2594,11 +2723,11 @@ async def cancel_delete_callback(callback: types.CallbackQuery, state: FSMContex
 
 @dp.message(Command("admin_delete_player"))
 async def cmd_admin_delete_player(message: types.Message, state: FSMContext):
-    logger.info(f"Пользователь {message.from_user.id} запросил административное удаление игрока")
+    logger.info("Пользователь %s запросил административное удаление игрока", message.from_user.id)
     
     # Проверяем, является ли пользователь администратором
-    if message.from_user.id != 5259325234:  # Только для вас
-        logger.warning(f"Пользователь {message.from_user.id} попытался использовать админ-команду")
+    if message.from_user.id not in ADMINS:
+        logger.warning("Пользователь %s попытался использовать админ-команду", message.from_user.id)
         await message.answer("❌ У вас нет прав для выполнения этой команды.")
         return
     
@@ -2606,32 +2735,31 @@ async def cmd_admin_delete_player(message: types.Message, state: FSMContext):
     try:
         user_id = int(message.text.split()[1])
     except (IndexError, ValueError):
-        logger.warning(f"Некорректный формат команды от администратора {message.from_user.id}")
+        logger.warning("Некорректный формат команды от администратора %s", message.from_user.id)
         await message.answer("❌ Укажите ID игрока: /admin_delete_player <ID>")
         return
     
     # Проверяем, существует ли игрок
     player = await get_player(user_id)
     if not player:
-        logger.warning(f"Администратор {message.from_user.id} попытался удалить несуществующего игрока {user_id}")
+        logger.warning("Администратор %s попытался удалить несуществующего игрока %s", message.from_user.id, user_id)
         await message.answer(f"❌ Игрок с ID {user_id} не найден в базе данных.")
         return
     
     # Удаляем игрока
-    logger.info(f"Администратор {message.from_user.id} удалил игрока {player.name} (ID: {user_id})")
+    logger.info("Администратор %s удалил игрока %s (ID: %s)", message.from_user.id, player.name, user_id)
     await delete_player(user_id)
     await message.answer(f"✅ Игрок {player.name} (ID: {user_id}) успешно удален из базы данных.")
 
 @dp.message(Command("play"))
 async def cmd_play(message: types.Message, state: FSMContext):
     # Проверяем, не идет ли уже матч
-    current_state = await state.get_state()
-    if current_state == GameStates.playing.state:
+    if await is_match_in_progress(message.from_user.id, state):
         await message.answer("У вас уже идет матч!")
         return
         
     # Получаем данные игрока
-    player = await get_player(message.from_user.id)
+    player = await get_player_cached(message.from_user.id)
     if not player:
         await message.answer("Вы еще не создали игрока. Используйте /start для начала игры.")
         return
@@ -2644,6 +2772,7 @@ async def cmd_play(message: types.Message, state: FSMContext):
     
     # Устанавливаем состояние playing
     await state.set_state(GameStates.playing)
+    _PLAYING_USERS.add(message.from_user.id)
     
     # Инициализируем состояние матча
     match_state = {
@@ -2655,7 +2784,6 @@ async def cmd_play(message: types.Message, state: FSMContext):
         'current_team': player.club,
         'opponent_team': await get_opponent_by_round(player, player.current_round),
         'current_round': player.current_round,
-        'is_processing': False,
         'is_home': True,  # По умолчанию домашний матч
         'player_id': message.from_user.id,
         'player_name': player.name,
@@ -2663,15 +2791,7 @@ async def cmd_play(message: types.Message, state: FSMContext):
         'player_position': player.position,
         'score': {'home': 0, 'away': 0},
         'stats': {
-            "goals": 0,
-            "assists": 0,
-            "saves": 0,
-            "tackles": 0,
-            "fouls": 0,
-            "passes": 0,
-            "interceptions": 0,
-            "clearances": 0,
-            "throws": 0,
+            **_DEFAULT_STATS,
             'shots': {'home': 0, 'away': 0},
             'shots_on_target': {'home': 0, 'away': 0},
             'possession': {'home': 50, 'away': 50},
@@ -2689,44 +2809,27 @@ async def cmd_play(message: types.Message, state: FSMContext):
 @dp.message(Command("stats"))
 async def cmd_stats(message: types.Message, state: FSMContext):
     # Проверяем, не идет ли сейчас матч
-    current_state = await state.get_state()
-    if current_state == GameStates.playing.state:
+    if await is_match_in_progress(message.from_user.id, state):
         await message.answer("Нельзя просматривать статистику во время матча!")
         return
         
     # Получаем данные игрока
-    player = await get_player(message.from_user.id)
+    player = await get_player_cached(message.from_user.id)
     if not player:
         await message.answer("Вы еще не создали игрока. Используйте /start для начала игры.")
         return
     
-    # Формируем сообщение со статистикой
-    stats_message = (
-        f"📊 Статистика игрока {player.name}\n\n"
-        f"🏃 Позиция: {player.position}\n"
-        f"🏟️ Клуб: {player.club}\n"
-        f"🎮 Матчей сыграно: {player.matches}\n"
-        f"✅ Побед: {player.wins}\n"
-        f"🤝 Ничьих: {player.draws}\n"
-        f"❌ Поражений: {player.losses}\n"
-        f"⚽ Голов: {player.goals}\n"
-        f"🎯 Голевых передач: {player.assists}\n"
-        f"🖐️ Сейвов: {player.saves}\n"
-        f"🛡️ Отборов: {player.tackles}\n"
-    )
-    
-    await message.answer(stats_message, reply_markup=get_main_menu_keyboard())
+    await message.answer(_format_stats(player), reply_markup=get_main_menu_keyboard())
 
 @dp.message(Command("calendar"))
 async def cmd_calendar(message: types.Message, state: FSMContext):
     # Проверяем, не идет ли сейчас матч
-    current_state = await state.get_state()
-    if current_state == GameStates.playing.state:
+    if await is_match_in_progress(message.from_user.id, state):
         await message.answer("Нельзя просматривать календарь во время матча!")
         return
         
     # Получаем данные игрока
-    player = await get_player(message.from_user.id)
+    player = await get_player_cached(message.from_user.id)
     if not player:
         await message.answer("Вы еще не создали игрока. Используйте /start для начала игры.")
         return
@@ -2742,53 +2845,59 @@ async def cmd_calendar(message: types.Message, state: FSMContext):
 async def main():
     # Создаем таблицы, если их нет
     await init_db()
+    await ensure_fsm_storage()
     # Рассылаем уведомление о запуске
-    user_ids = await get_all_user_ids()
-    if user_ids:
-        await notify_users(bot, user_ids, "Снова в строю!\nБот был выключен из за технических неполадок. Предоставляем свои извинения.")
-    # Запускаем бота
+    await notify_users(bot, iter_all_user_ids(), "Снова в строю!\nБот был выключен из за технических неполадок. Предоставляем свои извинения.")
+    # Запускаем бота. start_polling сам обрабатывает SIGINT/SIGTERM и штатно завершается
     try:
         await dp.start_polling(bot)
     finally:
+        # Рассылаем уведомление о выключении, пока цикл событий и сессия бота еще работают
+        try:
+            await notify_users(bot, iter_all_user_ids(), "Бот выключен")
+        except Exception as e:
+            logger.error(f"Ошибка при рассылке уведомления о выключении: {e}")
+        await _drain_pending_writes()
         await bot.session.close()
 
 # Функция для создания персонального календаря игрока
+def _build_club_calendars():
+    """Раскладывает общий календарь по клубам за один проход"""
+    club_matches = {}
+    for home_team, away_team, round_num in MATCH_CALENDAR:
+        club_matches.setdefault(home_team, []).append({"round": round_num, "opponent": away_team, "is_home": True})
+        club_matches.setdefault(away_team, []).append({"round": round_num, "opponent": home_team, "is_home": False})
+    for matches in club_matches.values():
+        matches.sort(key=lambda match: match["round"])
+    return club_matches
+
+# Персональные календари клубов: разобранные (только для чтения) и в виде JSON для базы
+_CLUB_CALENDARS_PARSED: dict[str, list[dict]] = _build_club_calendars()
+_CLUB_CALENDARS: dict[str, str] = {
+    club: json_dumps(matches) for club, matches in _CLUB_CALENDARS_PARSED.items()
+}
+
 def create_player_calendar(club_name):
     """
     Создает личный календарь матчей для игрока заданного клуба
     Возвращает JSON строку с календарем на весь сезон (18 туров)
     """
-    try:
-        player_calendar = []
-        
-        # Для каждого тура находим матч с участием клуба игрока
-        for home_team, away_team, round_num in MATCH_CALENDAR:
-            # Проверяем, участвует ли клуб игрока в матче
-            if home_team == club_name or away_team == club_name:
-                # Определяем соперника и флаг домашнего матча
-                opponent = away_team if home_team == club_name else home_team
-                is_home = (home_team == club_name)
-                
-                # Добавляем матч в персональный календарь
-                player_calendar.append({
-                    "round": round_num,
-                    "opponent": opponent,
-                    "is_home": is_home
-                })
-        
-        # Сортируем по туру
-        player_calendar.sort(key=lambda match: match["round"])
-        
-        # Проверяем, что календарь не пустой
-        if not player_calendar:
-            logger.error(f"Не удалось создать календарь для клуба {club_name}")
-            return json.dumps([])
-        
-        logger.info(f"Создан персональный календарь для клуба {club_name} из {len(player_calendar)} матчей")
-        return json.dumps(player_calendar)
-    except Exception as e:
-        logger.error(f"Ошибка при создании календаря для клуба {club_name}: {e}")
-        return json.dumps([])
+    calendar_json = _CLUB_CALENDARS.get(club_name)
+    if calendar_json is None:
+        logger.error("Не удалось создать календарь для клуба %s", club_name)
+        return "[]"
+    return calendar_json
+
+# Пояснения к календарю матчей
+_CALENDAR_LEGEND = (
+    "\n📋 Пояснения:\n"
+    "➡️ - Ваш следующий матч\n"
+    "🏠 - Домашний матч\n"
+    "🚌 - Выездной матч\n"
+    "⭐⭐⭐ - Сильный соперник\n"
+    "⭐⭐ - Средний соперник\n"
+    "⭐ - Слабый соперник\n"
+)
 
 async def generate_calendar_visualization(player, upcoming_matches):
     """Создает визуальное представление календаря для игрока с эмодзи"""
@@ -2809,13 +2918,7 @@ async def generate_calendar_visualization(player, upcoming_matches):
             location_emoji = "🏠" if is_home else "🚌"
             
             # Сила соперника (в зависимости от лиги)
-            opponent_strength = FNL_SILVER_CLUBS.get(opponent, {}).get("strength", 50)
-            if opponent_strength >= 70:
-                difficulty_emoji = "⭐⭐⭐" # Сильный соперник
-            elif opponent_strength >= 50:
-                difficulty_emoji = "⭐⭐" # Средний соперник
-            else:
-                difficulty_emoji = "⭐" # Слабый соперник
+            difficulty_emoji = _CLUB_DIFFICULTY.get(opponent, _DEFAULT_DIFFICULTY)
             
             # Отмечаем текущий тур
             current_marker = "➡️ " if round_num == player.current_round else "   "
@@ -2823,29 +2926,22 @@ async def generate_calendar_visualization(player, upcoming_matches):
             # Добавляем строку с матчем
             calendar_text += f"{current_marker}Тур {round_num}: {location_emoji} {opponent} {difficulty_emoji}\n"
         
-        calendar_text += "\n📋 Пояснения:\n"
-        calendar_text += "➡️ - Ваш следующий матч\n"
-        calendar_text += "🏠 - Домашний матч\n"
-        calendar_text += "🚌 - Выездной матч\n"
-        calendar_text += "⭐⭐⭐ - Сильный соперник\n"
-        calendar_text += "⭐⭐ - Средний соперник\n"
-        calendar_text += "⭐ - Слабый соперник\n"
+        calendar_text += _CALENDAR_LEGEND
         
         return calendar_text
     except Exception as e:
-        logger.error(f"Ошибка при создании визуализации календаря: {e}")
+        logger.error("Ошибка при создании визуализации календаря: %s", e)
         return "Ошибка при создании календаря"
 
-@dp.callback_query(lambda c: c.data == "show_calendar")
+@dp.callback_query(F.data == "show_calendar")
 async def show_calendar_callback(callback: types.CallbackQuery, state: FSMContext):
     # Проверяем, не идет ли сейчас матч
-    current_state = await state.get_state()
-    if current_state == GameStates.playing.state:
+    if await is_match_in_progress(callback.from_user.id, state):
         await callback.answer("Нельзя просматривать календарь во время матча!", show_alert=True)
         return
         
     # Получаем данные игрока
-    player = await get_player(callback.from_user.id)
+    player = await get_player_cached(callback.from_user.id)
     if not player:
         await callback.message.answer("Вы еще не создали игрока. Используйте /start для начала игры.")
         return
@@ -2858,85 +2954,115 @@ async def show_calendar_callback(callback: types.CallbackQuery, state: FSMContex
     
     await callback.message.answer(calendar_text, reply_markup=get_main_menu_keyboard())
 
+async def _load_player_calendar(player):
+    """Возвращает список матчей персонального календаря игрока, создавая календарь при отсутствии"""
+    # Проверяем наличие атрибута personal_calendar
+    if not hasattr(player, 'personal_calendar') or not player.personal_calendar:
+        logger.warning(f"У игрока {player.name} (ID: {player.user_id}) отсутствует календарь, создаем новый")
+        # Создаем календарь для игрока, если его нет
+        calendar_json = create_player_calendar(player.club)
+        # Сохраняем календарь в базу
+        await update_player_stats(
+            user_id=player.user_id,
+            personal_calendar=calendar_json
+        )
+        calendar = _CLUB_CALENDARS_PARSED.get(player.club, [])
+    elif player.personal_calendar == _CLUB_CALENDARS.get(player.club):
+        # Календарь совпадает с календарем клуба - берем уже разобранный
+        calendar = _CLUB_CALENDARS_PARSED[player.club]
+    else:
+        # Парсим JSON календарь
+        calendar = json_loads(player.personal_calendar)
+    return calendar
+
+# Разобранные календари игроков: user_id -> (клуб, матчи по возрастанию тура, номера туров)
+# (LRU, не более _PARSED_CALENDAR_CACHE_MAX записей)
+_PARSED_CALENDAR_CACHE_MAX = 1024
+_parsed_calendar_cache: OrderedDict[int, tuple[str, list[dict], list[int]]] = OrderedDict()
+
+def _forget_calendar(user_id):
+    """Сбрасывает разобранный календарь игрока после смены клуба, сезона или удаления"""
+    _parsed_calendar_cache.pop(user_id, None)
+
 async def get_player_next_matches(player, count=5):
     """Получает ближайшие матчи из персонального календаря игрока"""
     try:
-        # Проверяем наличие атрибута personal_calendar
-        if not hasattr(player, 'personal_calendar') or not player.personal_calendar:
-            logger.warning(f"У игрока {player.name} (ID: {player.user_id}) отсутствует календарь, создаем новый")
-            # Создаем календарь для игрока, если его нет
-            calendar_json = create_player_calendar(player.club)
-            # Сохраняем календарь в базу
-            await update_player_stats(
-                user_id=player.user_id,
-                personal_calendar=calendar_json
-            )
-            calendar = json.loads(calendar_json)
+        cached = _parsed_calendar_cache.get(player.user_id)
+        if cached is not None and cached[0] == player.club:
+            _, calendar, rounds = cached
+            _parsed_calendar_cache.move_to_end(player.user_id)
         else:
-            # Парсим JSON календарь
-            calendar = json.loads(player.personal_calendar)
+            calendar = sorted(await _load_player_calendar(player), key=lambda x: x["round"])
+            rounds = [match["round"] for match in calendar]
+            _parsed_calendar_cache[player.user_id] = (player.club, calendar, rounds)
+            _parsed_calendar_cache.move_to_end(player.user_id)
+            if len(_parsed_calendar_cache) > _PARSED_CALENDAR_CACHE_MAX:
+                _parsed_calendar_cache.popitem(last=False)
         
         # Находим текущий тур
         current_round = player.current_round if player.matches > 0 else 1
         
-        # Фильтруем матчи, которые еще не сыграны (тур >= текущий)
-        upcoming_matches = [match for match in calendar if match["round"] >= current_round]
-        
-        # Сортируем по номеру тура
-        upcoming_matches.sort(key=lambda x: x["round"])
-        
-        # Возвращаем указанное количество ближайших матчей
-        return upcoming_matches[:count]
+        # Матчи отсортированы по туру: несыгранные (тур >= текущий) начинаются с позиции бинарного поиска
+        start = bisect_left(rounds, current_round)
+        return calendar[start:start + count]
     except Exception as e:
-        logger.error(f"Ошибка при получении календаря игрока {player.name}: {e}")
+        logger.error("Ошибка при получении календаря игрока %s: %s", player.name, e)
         return []
 
 # Функция создания календаря для нового сезона
 async def start_new_season(player):
-    """Начинает новый сезон для игрока"""
+    """Начинает новый сезон для игрока и возвращает обновленного игрока (None при ошибке)"""
     try:
         if not player:
             logger.error("Передан пустой объект игрока")
-            return False
+            return None
             
         # Создаем новый календарь
         calendar_json = create_player_calendar(player.club)
         if not calendar_json:
-            logger.error(f"Не удалось создать календарь для клуба {player.club}")
-            return False
+            logger.error("Не удалось создать календарь для клуба %s", player.club)
+            return None
             
         # Обновляем данные игрока
         try:
-            await update_player_stats(
+            if not await update_player_stats(
                 user_id=player.user_id,
                 current_round=1,
                 last_match_date=SEASON_START_DATE,
                 personal_calendar=calendar_json
-            )
-            logger.info(f"Новый сезон успешно начат для игрока {player.name}")
-            return True
+            ):
+                return None
+            _forget_calendar(player.user_id)
+            # Синхронизируем объект игрока с базой, чтобы не перечитывать его
+            player.current_round = 1
+            player.last_match_date = SEASON_START_DATE
+            player.personal_calendar = calendar_json
+            logger.info("Новый сезон успешно начат для игрока %s", player.name)
+            return player
         except Exception as e:
-            logger.error(f"Ошибка при обновлении данных игрока {player.name}: {e}")
-            return False
+            logger.error("Ошибка при обновлении данных игрока %s: %s", player.name, e)
+            return None
             
     except Exception as e:
-        logger.error(f"Критическая ошибка при начале нового сезона: {e}")
-        return False
+        logger.error("Критическая ошибка при начале нового сезона: %s", e)
+        return None
 
 # Функция для полного сброса базы данных
 async def reset_database():
-    """Полностью сбрасывает базу данных, удаляя и пересоздавая все таблицы"""
+    """Полностью сбрасывает базу данных, очищая все таблицы с сохранением схемы"""
     try:
         logger.warning("Начинаем полный сброс базы данных...")
         
-        # Удаляем все таблицы
         async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.drop_all)
-            logger.info("Все таблицы успешно удалены")
-            
-            # Пересоздаем таблицы
+            # Создаем недостающие таблицы (при первом запуске), существующие не трогаем
             await conn.run_sync(Base.metadata.create_all)
-            logger.info("Таблицы успешно пересозданы")
+            # Очищаем все таблицы одним TRUNCATE в той же транзакции
+            tables = ", ".join(table.name for table in reversed(Base.metadata.sorted_tables))
+            await conn.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+            logger.info("Все таблицы успешно очищены")
+        _parsed_calendar_cache.clear()
+        _player_cache.clear()
+        _match_cache.clear()
         
         logger.warning("База данных полностью сброшена")
         return True
@@ -2944,36 +3070,39 @@ async def reset_database():
         logger.error(f"Критическая ошибка при сбросе базы данных: {e}")
         return False
 
+_RESET_DATABASE_CONFIRM_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="✅ Да, полностью сбросить", callback_data="confirm_reset_database")],
+    [InlineKeyboardButton(text="❌ Нет, отмена", callback_data="cancel_reset_database")]
+])
+
 @dp.message(Command("reset_database"))
 async def cmd_reset_database(message: types.Message, state: FSMContext):
     """Команда для полного сброса базы данных"""
     logger.warning(f"Пользователь {message.from_user.id} запросил сброс всей базы данных")
     
     # Проверяем, является ли пользователь администратором
-    if message.from_user.id != 5259325234:  # ID администратора
+    if message.from_user.id not in ADMINS:
         logger.warning(f"Пользователь {message.from_user.id} попытался сбросить базу данных без прав администратора")
         await message.answer("❌ Куда ты лезешь, умник")
         return
     
     # Запрашиваем подтверждение
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Да, полностью сбросить", callback_data="confirm_reset_database")],
-        [InlineKeyboardButton(text="❌ Нет, отмена", callback_data="cancel_reset_database")]
-    ])
-    
     await message.answer(
         "⚠️ ВНИМАНИЕ! ⚠️\n\n"
         "Вы собираетесь полностью сбросить базу данных!\n"
         "Все данные игроков, включая статистику и прогресс, будут безвозвратно удалены.\n\n"
         "Вы абсолютно уверены, что хотите продолжить?",
-        reply_markup=keyboard
+        reply_markup=_RESET_DATABASE_CONFIRM_KB
     )
 
-@dp.callback_query(lambda c: c.data == "confirm_reset_database")
+@dp.callback_query(F.data == "confirm_reset_database")
 async def confirm_reset_database_callback(callback: types.CallbackQuery, state: FSMContext):
     """Подтверждение сброса базы данных"""
+    if _is_duplicate_callback(callback):
+        await callback.answer()
+        return
     # Проверяем, является ли пользователь администратором
-    if callback.from_user.id != 5259325234:  # ID администратора
+    if callback.from_user.id not in ADMINS:
         logger.warning(f"Пользователь {callback.from_user.id} попытался сбросить базу данных без прав администратора")
         await callback.message.answer("❌ У вас нет прав для выполнения этой операции.")
         await callback.answer()
@@ -2987,7 +3116,7 @@ async def confirm_reset_database_callback(callback: types.CallbackQuery, state:
     if success:
         await callback.message.edit_text(
             "✅ База данных успешно сброшена!\n"
-            "Все данные удалены и структура таблиц пересоздана."
+            "Все данные удалены, структура таблиц сохранена."
         )
         logger.warning(f"Администратор {callback.from_user.id} успешно выполнил полный сброс базы данных")
     else:
@@ -2997,12 +3126,9 @@ async def confirm_reset_database_callback(callback: types.CallbackQuery, state:
         )
         logger.error(f"Ошибка при попытке сброса базы данных администратором {callback.from_user.id}")
     
-    try:
-        await callback.answer()
-    except Exception as e:
-        logger.debug(f"Не удалось ответить на callback: {e}")
+    _fire(callback.answer())
 
-@dp.callback_query(lambda c: c.data == "cancel_reset_database")
+@dp.callback_query(F.data == "cancel_reset_database")
 async def cancel_reset_database_callback(callback: types.CallbackQuery, state: FSMContext):
     """Отмена сброса базы данных"""
     await callback.message.edit_text(
@@ -3011,10 +3137,7 @@ async def cancel_reset_database_callback(callback: types.CallbackQuery, state: F
     )
     logger.info(f"Пользователь {callback.from_user.id} отменил сброс базы данных")
     
-    try:
-        await callback.answer()
-    except Exception as e:
-        logger.debug(f"Не удалось ответить на callback: {e}")
+    _fire(callback.answer())
 
 async def start_match(message, match_state, state: FSMContext):
     """Запускает игровой процесс, отображает первое игровое сообщение"""
@@ -3027,21 +3150,13 @@ async def start_match(message, match_state, state: FSMContext):
         is_home = match_state.get('is_home', True)
         
         # Получаем виртуальную дату
-        player = await get_player(match_state['player_id'])
+        player = await get_player_cached(match_state['player_id'])
         virtual_date = await get_virtual_date(player)
         
         # Инициализируем статистику всеми полями, чтобы избежать KeyError
-        match_state['stats'] = {
-            "goals": 0,
-            "assists": 0,
-            "saves": 0,
-            "tackles": 0,
-            "fouls": 0,
-            "passes": 0,
-            "interceptions": 0,
-            "clearances": 0,
-            "throws": 0
-        }
+        match_state['stats'] = dict(_DEFAULT_STATS)
+        # Подписи с названиями команд берем из кэша по паре команд
+        match_state['captions'] = _build_captions(current_team, opponent_team)
         
         # Инициализируем счетчики голов и время
         match_state['your_goals'] = 0
@@ -3049,13 +3164,8 @@ async def start_match(message, match_state, state: FSMContext):
         match_state['minute'] = 0
         
         # Добавляем флаг атаки соперника для защитников и вратарей
-        if position in ["Вратарь", "Защитник"]:
-            match_state['is_opponent_attack'] = True
-        else:
-            match_state['is_opponent_attack'] = False
-        
-        # Сохраняем обновленное состояние
-        await state.update_data(match_state=match_state)
+        profile = get_position_profile(position)
+        match_state['is_opponent_attack'] = profile['defensive']
         
         # Формируем текст сообщения
         match_text = (
@@ -3071,10 +3181,8 @@ async def start_match(message, match_state, state: FSMContext):
         match_text += f"⏱️ 0' минута. Счёт: 0-0\n\n"
         
         # Разные сообщения в зависимости от позиции
-        if position in ["Вратарь", "Защитник"]:
-            match_text += f"⚠️ {opponent_team} начинает атаку!\nВыберите действие:"
-        else:
-            match_text += f"⚽ {current_team} владеет мячом.\nВыберите действие:"
+        match_text += profile['kickoff_text'].format(team=current_team, opponent=opponent_team)
+        match_text += "\nВыберите действие:"
         
         # Создаем клавиатуру в зависимости от позиции
         keyboard = get_match_actions_keyboard(position)
@@ -3086,21 +3194,19 @@ async def start_match(message, match_state, state: FSMContext):
             reply_markup=keyboard
         )
         
-        # Обновляем last_message_id в состоянии матча
+        # Сохраняем состояние матча вместе с last_message_id одной записью
         match_state['last_message_id'] = first_message.message_id
-        await state.update_data(match_state=match_state)
+        await _commit(state, match_state)
         
         logger.info(f"Матч начат. ID первого сообщения: {first_message.message_id}")
         
     except Exception as e:
         logger.error(f"Ошибка при начале матча: {e}")
         await message.answer("Произошла ошибка при начале матча. Попробуйте еще раз.")
-        await state.clear()
+        await clear_match_state(state)
 
-@dp.callback_query(lambda c: c.data.startswith('continue_match_'))
-async def handle_continue_match(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    match_state = data.get('match_state')
+@dp.callback_query(F.data.startswith("continue_match_"))
+async def handle_continue_match(callback: types.CallbackQuery, match_state, state: FSMContext):
     if not match_state:
         await callback.message.answer(
             "Матч не начат или уже завершен. Нажмите 'Играть матч' для начала нового матча."
@@ -3113,48 +3219,57 @@ async def handle_continue_match(callback: types.CallbackQuery, state: FSMContext
     if match_state.get('match_finished', False) or match_state.get('minute', 0) >= 90:
         await callback.answer("Матч завершён. Нажмите 'Играть матч' для нового матча.", show_alert=True)
         return
-    if match_state.get('is_processing', False):
+    lock = _user_lock(callback.from_user.id)
+    if lock.locked():
         try:
             await callback.answer("Дождитесь завершения текущего момента", show_alert=True)
         except Exception as e:
             logger.debug(f"Не удалось ответить на callback: {e}")
         return
-    match_state['is_processing'] = True
-    await state.update_data(match_state=match_state)
-    try:
+    # Повторное нажатие той же кнопки (двойной тап или повторная доставка) игнорируем
+    if _is_duplicate_callback(callback):
         try:
             await callback.answer()
         except Exception as e:
             logger.debug(f"Не удалось ответить на callback: {e}")
-        await continue_match(callback, match_state, state)
-    except Exception as e:
-        logger.error(f"Ошибка при продолжении матча: {e}")
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
+        return
+    async with lock:
         try:
-            await callback.answer("Произошла ошибка. Попробуйте еще раз.", show_alert=True)
-        except Exception as err:
-            logger.debug(f"Не удалось ответить на callback после ошибки: {err}")
-    finally:
-        match_state['is_processing'] = False
-        await state.update_data(match_state=match_state)
+            try:
+                await callback.answer()
+            except Exception as e:
+                logger.debug(f"Не удалось ответить на callback: {e}")
+            # continue_match сам сохраняет состояние матча
+            await continue_match(callback, match_state, state)
+        except Exception as e:
+            logger.error(f"Ошибка при продолжении матча: {e}")
+            try:
+                await callback.answer("Произошла ошибка. Попробуйте еще раз.", show_alert=True)
+            except Exception as err:
+                logger.debug(f"Не удалось ответить на callback после ошибки: {err}")
+        finally:
+            # Если новый момент не отправлен (ошибка), кнопку можно нажать еще раз
+            if match_state.get('last_message_id') == callback.message.message_id:
+                _seen_callbacks.pop(_callback_key(callback), None)
 
 # Функция для проверки прав администратора
 def is_admin(user_id: int) -> bool:
-    return user_id == 5259325234  # Ваш ID
+    return user_id in ADMINS
+
+_ADMIN_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📅 Изменить дату", callback_data="admin_change_date")],
+    [InlineKeyboardButton(text="🔄 Изменить тур", callback_data="admin_change_round")],
+    [InlineKeyboardButton(text="⚽ Изменить голы", callback_data="admin_change_goals")],
+    [InlineKeyboardButton(text="🎯 Изменить передачи", callback_data="admin_change_assists")],
+    [InlineKeyboardButton(text="🖐️ Изменить сейвы", callback_data="admin_change_saves")],
+    [InlineKeyboardButton(text="🛡️ Изменить отборы", callback_data="admin_change_tackles")],
+    [InlineKeyboardButton(text="🔍 Выбрать игрока", callback_data="admin_select_player")],
+    [InlineKeyboardButton(text="⬅️ Назад", callback_data="return_to_menu")]
+])
 
 # Клавиатура админ-панели
 def get_admin_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📅 Изменить дату", callback_data="admin_change_date")],
-        [InlineKeyboardButton(text="🔄 Изменить тур", callback_data="admin_change_round")],
-        [InlineKeyboardButton(text="⚽ Изменить голы", callback_data="admin_change_goals")],
-        [InlineKeyboardButton(text="🎯 Изменить передачи", callback_data="admin_change_assists")],
-        [InlineKeyboardButton(text="🖐️ Изменить сейвы", callback_data="admin_change_saves")],
-        [InlineKeyboardButton(text="🛡️ Изменить отборы", callback_data="admin_change_tackles")],
-        [InlineKeyboardButton(text="🔍 Выбрать игрока", callback_data="admin_select_player")],
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="return_to_menu")]
-    ])
+    return _ADMIN_KB
 
 @dp.message(Command("admin_panel"))
 async def cmd_admin_panel(message: types.Message, state: FSMContext):
@@ -3165,94 +3280,27 @@ async def cmd_admin_panel(message: types.Message, state: FSMContext):
         "Введите ID игрока для админ-панели:")
     await state.set_state(GameStates.admin_waiting_player_id)
 
-@dp.callback_query(lambda c: c.data.startswith('admin_'))
-async def handle_admin_callback(callback: types.CallbackQuery, state: FSMContext):
-    if not is_admin(callback.from_user.id):
-        await callback.answer("❌ У вас нет прав для доступа к админ-панели.", show_alert=True)
-        return
-    action = callback.data.split('_')[1]
-    if action == "back":
-        await callback.message.delete()
-        return
-    if action == "select_player":
-        await callback.message.answer(
-            "Введите ID игрока:"
-        )
-        await state.set_state(GameStates.admin_waiting_player_id)
-        await callback.answer()  # Отвечаем на callback, чтобы убрать часики
-        return
-    # Получаем текущий выбранный ID игрока из базы данных
-    admin = await get_player(callback.from_user.id)
-    player_id = admin.admin_selected_player_id if admin else None
-    
-    if not player_id:
-        await callback.message.answer(
-            "Сначала выберите игрока!",
-            reply_markup=get_admin_keyboard()
-        )
-        await callback.answer()  # Отвечаем на callback
-        return
-    
-    if action == "change_date":
-        await callback.message.answer(
-            "Введите количество дней для изменения (например, +7 или -3):"
-        )
-        await state.set_state(GameStates.admin_waiting_date_change)
-        await callback.answer()
-    
-    elif action == "change_round":
-        await callback.message.answer(
-            "Введите новый номер тура (от 1 до 18):"
-        )
-        await state.set_state(GameStates.admin_waiting_round_change)
-        await callback.answer()
-    
-    elif action == "change_goals":
-        await callback.message.answer(
-            "Введите изменение количества голов (например, +2 или -1):"
-        )
-        await state.set_state(GameStates.admin_waiting_goals_change)
-        await callback.answer()
-    
-    elif action == "change_assists":
-        await callback.message.answer(
-            "Введите изменение количества передач (например, +2 или -1):"
-        )
-        await state.set_state(GameStates.admin_waiting_assists_change)
-        await callback.answer()
-    
-    elif action == "change_saves":
-        await callback.message.answer(
-            "Введите изменение количества сейвов (например, +5 или -2):"
-        )
-        await state.set_state(GameStates.admin_waiting_saves_change)
-        await callback.answer()
-    
-    elif action == "change_tackles":
-        await callback.message.answer(
-            "Введите изменение количества отборов (например, +3 или -1):"
-        )
-        await state.set_state(GameStates.admin_waiting_tackles_change)
-        await callback.answer()
+# ID игрока, выбранного администратором, хранится в FSM, чтобы не читать строку админа из базы на каждом шаге
+async def get_admin_selected_player_id(state: FSMContext):
+    data = await state.get_data()
+    return data.get('admin_selected_player_id')
 
 @dp.message(GameStates.admin_waiting_player_id)
-async def process_admin_player_id(message: types.Message, state: FSMContext):
+async def process_admin_player_id(message: types.Message, state: FSMContext, db: AsyncSession):
     if not is_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав для доступа к админ-панели.")
         return
     try:
         player_id = int(message.text)
-        player = await get_player(player_id)
+        player = await get_player_cached(player_id, db)
         if not player:
             await message.answer(
                 "❌ Игрок не найден! Попробуйте еще раз:"
             )
             return
-        # Сохраняем выбранный ID в базе данных
-        admin = await get_player(message.from_user.id)
-        if admin:
-            await update_player_stats(message.from_user.id, admin_selected_player_id=player_id)
-            print(f"ID игрока {player_id} сохранен для админа {message.from_user.id}")  # Добавляем логирование
+        # Сохраняем выбранный ID в состоянии администратора
+        await state.update_data(admin_selected_player_id=player_id)
+        logger.info(f"ID игрока {player_id} сохранен для админа {message.from_user.id}")
         
         await message.answer(
             f"✅ Выбран игрок: {player.name}\n"
@@ -3263,204 +3311,142 @@ async def process_admin_player_id(message: types.Message, state: FSMContext):
         )
         await state.set_state(None)
     except ValueError:
-        print(f"Ошибка преобразования в число: {message.text}")  # Добавляем логирование
+        logger.warning(f"Ошибка преобразования в число: {message.text}")
         await message.answer(
             "❌ Некорректный ID! Введите числовой ID игрока:"
         )
     except Exception as e:
-        print(f"Неожиданная ошибка: {e}")  # Добавляем логирование
+        logger.error(f"Неожиданная ошибка: {e}")
         await message.answer(
             "❌ Произошла ошибка при обработке ID игрока. Попробуйте еще раз:"
         )
 
+# Целое число со знаком, как его вводит администратор (+7, -3, 12)
+_ADMIN_INT_RE = re.compile(r'^[+-]?\d+$')
+
+def _parse_admin_int(text):
+    """Возвращает введенное целое число или None, если ввод некорректен"""
+    text = (text or '').strip()
+    return int(text) if _ADMIN_INT_RE.match(text) else None
+
 @dp.message(GameStates.admin_waiting_date_change)
-async def process_admin_date_change(message: types.Message, state: FSMContext):
-    try:
-        days = int(message.text)
-        admin = await get_player(message.from_user.id)
-        player_id = admin.admin_selected_player_id if admin else None
-        
-        if not player_id:
-            await message.answer("❌ Сначала выберите игрока!")
-            return
-        
-        player = await get_player(player_id)
-        if not player:
-            await message.answer("❌ Игрок не найден!")
-            return
-        
-        # Изменяем дату
-        current_date = datetime.strptime(player.last_match_date, "%d.%m.%Y")
-        new_date = current_date + timedelta(days=days)
-        new_date_str = new_date.strftime("%d.%m.%Y")
-        
-        await update_player_stats(player_id, last_match_date=new_date_str)
-        
-        await message.answer(
-            f"✅ Дата успешно изменена!\n"
-            f"Новая дата: {new_date_str}",
-            reply_markup=get_admin_keyboard()
-        )
-        await state.set_state(None)
-    except ValueError:
+async def process_admin_date_change(message: types.Message, state: FSMContext, db: AsyncSession):
+    days = _parse_admin_int(message.text)
+    if days is None:
         await message.answer(
             "❌ Некорректное значение! Введите число дней (например, +7 или -3):"
         )
+        return
+    player_id = await get_admin_selected_player_id(state)
+    
+    if not player_id:
+        await message.answer("❌ Сначала выберите игрока!")
+        return
+    
+    # Изменяем дату прямо в базе
+    try:
+        new_date_str = await shift_last_match_date(player_id, days, db)
+        # Фиксируем изменение до ответа администратору и не держим блокировку строки во время запросов к Telegram
+        await db.commit()
+        _forget_player(player_id)
+    except Exception as e:
+        logger.error(f"Ошибка при изменении даты игрока {player_id}: {e}")
+        await db.rollback()
+        await message.answer("❌ Не удалось изменить дату: некорректная дата игрока в базе")
+        return
+    if new_date_str is None:
+        await message.answer("❌ Игрок не найден!")
+        return
+    
+    await message.answer(
+        f"✅ Дата успешно изменена!\n"
+        f"Новая дата: {new_date_str}",
+        reply_markup=get_admin_keyboard()
+    )
+    await state.set_state(None)
 
 @dp.message(GameStates.admin_waiting_round_change)
-async def process_admin_round_change(message: types.Message, state: FSMContext):
-    try:
-        new_round = int(message.text)
-        if not 1 <= new_round <= 18:
-            await message.answer("❌ Номер тура должен быть от 1 до 18!")
-            return
-        
-        admin = await get_player(message.from_user.id)
-        player_id = admin.admin_selected_player_id if admin else None
-        
-        if not player_id:
-            await message.answer("❌ Сначала выберите игрока!")
-            return
-        
-        player = await get_player(player_id)
-        if not player:
-            await message.answer("❌ Игрок не найден!")
-            return
-        
-        await update_player_stats(player_id, current_round=new_round)
-        
-        await message.answer(
-            f"✅ Тур успешно изменен!\n"
-            f"Новый тур: {new_round}",
-            reply_markup=get_admin_keyboard()
-        )
-        await state.set_state(None)
-    except ValueError:
+async def process_admin_round_change(message: types.Message, state: FSMContext, db: AsyncSession):
+    new_round = _parse_admin_int(message.text)
+    if new_round is None:
         await message.answer(
             "❌ Некорректное значение! Введите номер тура (от 1 до 18):"
         )
-
-@dp.message(GameStates.admin_waiting_goals_change)
-async def process_admin_goals_change(message: types.Message, state: FSMContext):
-    try:
-        change = int(message.text)
-        admin = await get_player(message.from_user.id)
-        player_id = admin.admin_selected_player_id if admin else None
-        
-        if not player_id:
-            await message.answer("❌ Сначала выберите игрока!")
-            return
-        
-        player = await get_player(player_id)
-        if not player:
-            await message.answer("❌ Игрок не найден!")
-            return
-        
-        new_goals = max(0, player.goals + change)
-        await update_player_stats(player_id, goals=new_goals)
-        
-        await message.answer(
-            f"✅ Количество голов успешно изменено!\n"
-            f"Новое количество: {new_goals}",
-            reply_markup=get_admin_keyboard()
-        )
-        await state.set_state(None)
-    except ValueError:
-        await message.answer(
-            "❌ Некорректное значение! Введите изменение (например, +2 или -1):"
-        )
-
-@dp.message(GameStates.admin_waiting_assists_change)
-async def process_admin_assists_change(message: types.Message, state: FSMContext):
+        return
+    if not 1 <= new_round <= 18:
+        await message.answer("❌ Номер тура должен быть от 1 до 18!")
+        return
+    
+    player_id = await get_admin_selected_player_id(state)
+    
+    if not player_id:
+        await message.answer("❌ Сначала выберите игрока!")
+        return
+    
     try:
-        change = int(message.text)
-        admin = await get_player(message.from_user.id)
-        player_id = admin.admin_selected_player_id if admin else None
-        
-        if not player_id:
-            await message.answer("❌ Сначала выберите игрока!")
-            return
-        
-        player = await get_player(player_id)
-        if not player:
-            await message.answer("❌ Игрок не найден!")
-            return
-        
-        new_assists = max(0, player.assists + change)
-        await update_player_stats(player_id, assists=new_assists)
-        
-        await message.answer(
-            f"✅ Количество передач успешно изменено!\n"
-            f"Новое количество: {new_assists}",
-            reply_markup=get_admin_keyboard()
-        )
-        await state.set_state(None)
-    except ValueError:
-        await message.answer(
-            "❌ Некорректное значение! Введите изменение (например, +2 или -1):"
-        )
+        updated = await update_player_stats(player_id, db, current_round=new_round)
+        await db.commit()
+        _forget_player(player_id)
+    except Exception as e:
+        logger.error(f"Ошибка при изменении тура игрока {player_id}: {e}")
+        await db.rollback()
+        await message.answer("❌ Не удалось изменить тур. Попробуйте еще раз.")
+        return
+    if not updated:
+        await message.answer("❌ Игрок не найден!")
+        return
+    
+    await message.answer(
+        f"✅ Тур успешно изменен!\n"
+        f"Новый тур: {new_round}",
+        reply_markup=get_admin_keyboard()
+    )
+    await state.set_state(None)
+
+# Изменяемые из админ-панели показатели: состояние -> (колонка, название в родительном падеже, пример ввода)
+_ADMIN_STAT_BY_STATE = {
+    GameStates.admin_waiting_goals_change.state: ('goals', 'голов', '+2 или -1'),
+    GameStates.admin_waiting_assists_change.state: ('assists', 'передач', '+2 или -1'),
+    GameStates.admin_waiting_saves_change.state: ('saves', 'сейвов', '+5 или -2'),
+    GameStates.admin_waiting_tackles_change.state: ('tackles', 'отборов', '+3 или -1'),
+}
 
-@dp.message(GameStates.admin_waiting_saves_change)
-async def process_admin_saves_change(message: types.Message, state: FSMContext):
-    try:
-        change = int(message.text)
-        admin = await get_player(message.from_user.id)
-        player_id = admin.admin_selected_player_id if admin else None
-        
-        if not player_id:
-            await message.answer("❌ Сначала выберите игрока!")
-            return
-        
-        player = await get_player(player_id)
-        if not player:
-            await message.answer("❌ Игрок не найден!")
-            return
-        
-        new_saves = max(0, player.saves + change)
-        await update_player_stats(player_id, saves=new_saves)
-        
-        await message.answer(
-            f"✅ Количество сейвов успешно изменено!\n"
-            f"Новое количество: {new_saves}",
-            reply_markup=get_admin_keyboard()
-        )
-        await state.set_state(None)
-    except ValueError:
+@dp.message(StateFilter(*_ADMIN_STAT_BY_STATE))
+async def process_admin_stat_change(message: types.Message, state: FSMContext, db: AsyncSession):
+    column, label, example = _ADMIN_STAT_BY_STATE[await state.get_state()]
+    change = _parse_admin_int(message.text)
+    if change is None:
         await message.answer(
-            "❌ Некорректное значение! Введите изменение (например, +5 или -2):"
+            f"❌ Некорректное значение! Введите изменение (например, {example}):"
         )
-
-@dp.message(GameStates.admin_waiting_tackles_change)
-async def process_admin_tackles_change(message: types.Message, state: FSMContext):
+        return
+    player_id = await get_admin_selected_player_id(state)
+    
+    if not player_id:
+        await message.answer("❌ Сначала выберите игрока!")
+        return
+    
     try:
-        change = int(message.text)
-        admin = await get_player(message.from_user.id)
-        player_id = admin.admin_selected_player_id if admin else None
-        
-        if not player_id:
-            await message.answer("❌ Сначала выберите игрока!")
-            return
-        
-        player = await get_player(player_id)
-        if not player:
-            await message.answer("❌ Игрок не найден!")
-            return
-        
-        new_tackles = max(0, player.tackles + change)
-        await update_player_stats(player_id, tackles=new_tackles)
-        
-        await message.answer(
-            f"✅ Количество отборов успешно изменено!\n"
-            f"Новое количество: {new_tackles}",
-            reply_markup=get_admin_keyboard()
-        )
-        await state.set_state(None)
-    except ValueError:
-        await message.answer(
-            "❌ Некорректное значение! Введите изменение (например, +3 или -1):"
-        )
+        new_value = await bump_stat(player_id, column, change, db)
+        await db.commit()
+        _forget_player(player_id)
+    except Exception as e:
+        logger.error(f"Ошибка при изменении показателя {column} игрока {player_id}: {e}")
+        await db.rollback()
+        await message.answer(f"❌ Не удалось изменить количество {label}. Попробуйте еще раз.")
+        return
+    if new_value is None:
+        await message.answer("❌ Игрок не найден!")
+        return
+    
+    await message.answer(
+        f"✅ Количество {label} успешно изменено!\n"
+        f"Новое количество: {new_value}",
+        reply_markup=get_admin_keyboard()
+    )
+    await state.set_state(None)
 
-@dp.callback_query(lambda c: c.data.startswith('admin_'))
+@dp.callback_query(F.data.startswith("admin_"))
 async def handle_admin_callback(callback: types.CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ У вас нет прав для доступа к админ-панели.", show_alert=True)
@@ -3469,20 +3455,19 @@ async def handle_admin_callback(callback: types.CallbackQuery, state: FSMContext
     if action == "select":  # admin_select_player
         await state.set_state(GameStates.admin_waiting_player_id)
         await callback.message.answer("Введите ID игрока:")
-        await callback.answer()
+        _fire(callback.answer())
         return
     if action == "back":
         await callback.message.delete()
         return
-    # Получаем текущий выбранный ID игрока из базы данных
-    admin = await get_player(callback.from_user.id)
-    player_id = admin.admin_selected_player_id if admin else None
+    # Получаем текущий выбранный ID игрока из состояния
+    player_id = await get_admin_selected_player_id(state)
     if not player_id:
         await callback.message.answer(
             "Сначала выберите игрока!",
             reply_markup=get_admin_keyboard()
         )
-        await callback.answer()
+        _fire(callback.answer())
         return
     if action == "change":
         subaction = callback.data.split('_')[2]
@@ -3491,120 +3476,111 @@ async def handle_admin_callback(callback: types.CallbackQuery, state: FSMContext
                 "Введите количество дней для изменения (например, +7 или -3):"
             )
             await state.set_state(GameStates.admin_waiting_date_change)
-            await callback.answer()
+            _fire(callback.answer())
         elif subaction == "round":
             await callback.message.answer(
                 "Введите новый номер тура (от 1 до 18):"
             )
             await state.set_state(GameStates.admin_waiting_round_change)
-            await callback.answer()
+            _fire(callback.answer())
         elif subaction == "goals":
             await callback.message.answer(
                 "Введите изменение количества голов (например, +2 или -1):"
             )
             await state.set_state(GameStates.admin_waiting_goals_change)
-            await callback.answer()
+            _fire(callback.answer())
         elif subaction == "assists":
             await callback.message.answer(
                 "Введите изменение количества передач (например, +2 или -1):"
             )
             await state.set_state(GameStates.admin_waiting_assists_change)
-            await callback.answer()
+            _fire(callback.answer())
         elif subaction == "saves":
             await callback.message.answer(
                 "Введите изменение количества сейвов (например, +5 или -2):"
             )
             await state.set_state(GameStates.admin_waiting_saves_change)
-            await callback.answer()
+            _fire(callback.answer())
         elif subaction == "tackles":
             await callback.message.answer(
                 "Введите изменение количества отборов (например, +3 или -1):"
             )
             await state.set_state(GameStates.admin_waiting_tackles_change)
-            await callback.answer()
+            _fire(callback.answer())
         return
     # Если не совпало ни с одним действием
     await callback.answer("Неизвестное действие", show_alert=True)
 
-def get_player_data(user_id: int) -> Optional[dict]:
+async def get_player_data(user_id: int) -> Optional[dict]:
     """Получает данные игрока из базы данных"""
     try:
-        with engine.connect() as conn:
-            # Получаем данные игрока
-            query = text("""
-                SELECT * FROM players 
-                WHERE user_id = :user_id
-            """)
-            result = conn.execute(query, {"user_id": user_id})
-            player = result.fetchone()
-            
-            if not player:
-                logger.error(f"Игрок не найден в базе данных (user_id: {user_id})")
-                return None
-                
-            # Преобразуем результат в словарь
-            player_dict = dict(player._mapping)
-            
-            # Проверяем наличие обязательных полей
-            required_fields = ['user_id', 'name', 'position', 'club']
-            missing_fields = [field for field in required_fields if field not in player_dict]
-            
-            if missing_fields:
-                logger.error(f"Отсутствуют обязательные поля в данных игрока: {missing_fields}")
-                return None
-                
-            logger.info(f"Успешно получены данные игрока из базы (user_id: {user_id})")
-            return player_dict
-            
+        async with async_session() as session:
+            player = await session.get(Player, user_id)
+        if not player:
+            logger.error(f"Игрок не найден в базе данных (user_id: {user_id})")
+            return None
+        # Преобразуем результат в словарь по колонкам таблицы
+        player_dict = {column.name: getattr(player, column.name) for column in Player.__table__.columns}
+        logger.info(f"Успешно получены данные игрока из базы (user_id: {user_id})")
+        return player_dict
     except Exception as e:
         logger.error(f"Ошибка при получении данных игрока из базы (user_id: {user_id}): {e}")
         return None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# Получить все user_id из базы
-async def get_all_user_ids():
+# Перебрать все user_id из базы, читая их курсором по мере надобности
+async def iter_all_user_ids():
     try:
         async with async_session() as session:
-            result = await session.execute(select(Player.user_id))
-            user_ids = [row[0] for row in result.fetchall()]
-            return user_ids
+            async for user_id in await session.stream_scalars(select(Player.user_id)):
+                yield user_id
     except Exception as e:
         logger.error(f"Ошибка при получении всех user_id: {e}")
-        return []
 
-# Функция рассылки уведомления всем пользователям
-async def notify_users(bot, user_ids, text):
-    for user_id in user_ids:
+# Одновременно отправляется не более NOTIFY_CONCURRENCY сообщений, и каждое занимает слот не меньше
+# NOTIFY_SLOT_SECONDS - так рассылка укладывается в глобальный лимит Telegram (~30 сообщений/с)
+NOTIFY_CONCURRENCY = 25
+NOTIFY_SLOT_SECONDS = 1
+
+# Функция отправки одного уведомления (заблокировавшие бота пользователи просто пропускаются)
+async def _notify_user(bot, user_id, text, semaphore):
+    # Слот семафора заранее занят в notify_users и освобождается здесь
+    try:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
         try:
-            await bot.send_message(user_id, text)
+            try:
+                await bot.send_message(user_id, text)
+            except TelegramRetryAfter as e:
+                # Telegram просит подождать - повторяем отправку один раз
+                await asyncio.sleep(e.retry_after)
+                await bot.send_message(user_id, text)
         except Exception as e:
             logger.error(f'Не удалось отправить сообщение {user_id}: {e}')
+        remaining = NOTIFY_SLOT_SECONDS - (loop.time() - started)
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+    finally:
+        semaphore.release()
+
+# Функция рассылки уведомления всем пользователям (user_ids - асинхронный итератор, например iter_all_user_ids())
+async def notify_users(bot, user_ids, text):
+    semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+    tasks = set()
+    async for user_id in user_ids:
+        # Ждем свободный слот до создания задачи: в памяти не больше NOTIFY_CONCURRENCY отправок
+        await semaphore.acquire()
+        task = asyncio.create_task(_notify_user(bot, user_id, text, semaphore))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
-        # Рассылаем уведомление о выключении
-        try:
-            import nest_asyncio
-            nest_asyncio.apply()
-            loop = asyncio.get_event_loop()
-            user_ids = loop.run_until_complete(get_all_user_ids())
-            if user_ids:
-                loop.run_until_complete(notify_users(bot, user_ids, "Бот выключен"))
-        except Exception as e:
-            logger.error(f"Ошибка при рассылке уведомления о выключении: {e}")
     except Exception as e:
         logger.critical(f"Критическая ошибка: {e}")
-        # Рассылаем уведомление о выключении
-        try:
-            import nest_asyncio
-            nest_asyncio.apply()
-            loop = asyncio.get_event_loop()
-            user_ids = loop.run_until_complete(get_all_user_ids())
-            if user_ids:
-                loop.run_until_complete(notify_users(bot, user_ids, "Бот выключен"))
-        except Exception as e2:
-            logger.error(f"Ошибка при рассылке уведомления о выключении: {e2}")
\ No newline at end of file